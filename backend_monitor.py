@@ -1,119 +1,84 @@
 import time
 from typing import get_origin
 import requests
-import copy
+import hashlib
+import json
 import logging
 
 from meta import MetaInfo
-from device import Device
-from rule import TAPRule, TriggerExpression, ConditionExpression, ActionExpression
-
-typ_map = {
-    'o': 'Output',
-    'i': 'Input',
-    'm': 'Memory'
-}
-
-datatype_map = {
-    'b': 'Bit',
-    'f': 'Float',
-    'dt': 'DateTime'
-}
-
-
-# Translate json rules from backend to TAPRules
-def json_to_rule_list(response_json):
-    rule_list = []
-    for rule_json in response_json['rules']:
-        trigger_dev = Device(
-            typ_map[rule_json['trigger']['dev']['typ']], 
-            datatype_map[rule_json['trigger']['dev']['data_typ']], 
-            int(rule_json['trigger']['dev']['address']), 
-            rule_json['trigger']['dev']['name']
-        )
-        trigger_comp =  rule_json['trigger']['comp']
-        trigger_val = rule_json['trigger']['val']
-        hold_t = rule_json['trigger']['hold_t']
-
-        trigger = TriggerExpression(trigger_dev, trigger_comp, trigger_val, hold_t=hold_t)
-
-        conditions = []
-        for cond in rule_json['conditions']:
-            condition_dev = Device(
-                typ_map[cond['dev']['typ']], 
-                datatype_map[cond['dev']['data_typ']], 
-                int(cond['dev']['address']), 
-                cond['dev']['name']
-            )
-            condition_comp = cond['comp']
-            condition_val = cond['val']
-            conditions.append(ConditionExpression(condition_dev, condition_comp, condition_val))
-        
-        action_dev = Device(
-            typ_map[rule_json['action']['dev']['typ']], 
-            datatype_map[rule_json['action']['dev']['data_typ']], 
-            int(rule_json['action']['dev']['address']), 
-            rule_json['action']['dev']['name']
-        )
-        action_comp = rule_json['action']['comp']
-        action_val = rule_json['action']['val']
-        action = ActionExpression(action_dev, action_comp, action_val)
-
-        rule_list.append(TAPRule(trigger, conditions, action))
-
-    return rule_list
-
-
-# Translate backend devs to Devices
-def json_to_dev_set(response_json):
-    dev_set = set()
-    for dev_json in response_json['devs']:
-        dev = Device(
-            typ_map[dev_json['typ']], 
-            datatype_map[dev_json['data_typ']], 
-            int(dev_json['address']), 
-            dev_json['name']
-        )
-        dev_set.add(dev)
-
-    return dev_set
+from rule import RuleSet
+from rule_decoder import json_to_rule_list, json_to_dev_names
+from dev_monitor import generate_monitor_data, drain_monitor_queue
 
 
 ###################################################
 # upload the traces onto the server
 # called from backend_monitor
+# Entries are streamed in batches from meta_info.trace_cursor
+# (the first entry the server has not acknowledged) up to the
+# entries recorded when the upload started. The cursor and the
+# cache token only move when the server acknowledges a batch,
+# so a failed upload resumes where it stopped.
+# Entries overwritten before they were uploaded (overwrite
+# policy of the TraceStore) are skipped, counted in
+# meta_info.trace_skipped and logged.
 ###################################################
+def ensure_csrf(meta_info: MetaInfo, client):
+    # the backend expects the CSRF token from get_cookie with every POST
+    if 'X-CSRFToken' not in client.headers:
+        response = client.get(meta_info.cookie_url, timeout=meta_info.request_timeout)
+        client.headers['X-CSRFToken'] = response.cookies['csrftoken']
+    return client
+
+
+def _skip_traces(meta_info: MetaInfo, seq):
+    # the entries from the cursor up to seq are gone, move the cursor past them
+    skipped = seq - meta_info.trace_cursor
+    if skipped > 0:
+        meta_info.trace_skipped += skipped
+        meta_info.trace_cursor = seq
+        meta_info.logger_trace.warning('%d trace entries were overwritten before upload' % skipped)
+
+
 def upload_traces(meta_info: MetaInfo):
     meta_info.logger_trace.info('Upload started. ')
     try:
-        client = requests.session()
-
-        response = client.get(meta_info.cookie_url)
-        headers = {}
-        headers['X-CSRFToken'] = response.cookies['csrftoken']
-
-        # we do not delete the trace itself in case the upload is not successful
-        trace = copy.deepcopy(meta_info.trace)
-        total_num = len(trace)
-        current_num = 0
-        cache_token = ''
-        while trace:
-            if len(trace) > meta_info.upload_batchsize:
-                data = {'trace': trace[:meta_info.upload_batchsize], 'token': meta_info.loc_token, 'last': False, 'cache_token': cache_token}
-                trace = trace[meta_info.upload_batchsize:]
-                current_num += meta_info.upload_batchsize
-            else:
-                data = {'trace': trace, 'token': meta_info.loc_token, 'last': True, 'cache_token': cache_token}
-                trace = []
-            response = client.post(meta_info.trace_url, json=data, headers=headers)
-            meta_info.logger_trace.info('Uploading... %d/%d' % (current_num, total_num))
-            cache_token = response.json()['cache_token']
+        if meta_info.trace_client is None:
+            meta_info.trace_client = requests.session()
+        client = ensure_csrf(meta_info, meta_info.trace_client)
+
+        trace = meta_info.trace
+        # entries recorded from now on go to the next upload
+        stop = trace.next_seq
+        _skip_traces(meta_info, trace.oldest_seq)
+        total_num = stop - meta_info.trace_cursor
+
+        batches = trace.iter_batches(meta_info.trace_cursor, stop, meta_info.upload_batchsize)
+        batch = next(batches, None)
+        if batch is None:
+            # nothing new, only close the upload
+            batch = (meta_info.trace_cursor, meta_info.trace_cursor, [])
+        while batch is not None:
+            batch_start, batch_stop, entries = batch
+            # entries may have been overwritten while the previous batch was sent
+            _skip_traces(meta_info, batch_start)
+            batch = next(batches, None)
+            data = {'trace': entries, 'token': meta_info.loc_token, 'last': batch is None, 'cache_token': meta_info.trace_cache_token}
+            response = client.post(meta_info.trace_url, json=data, timeout=meta_info.request_timeout)
             if response.status_code != 200:
                 meta_info.logger_trace.warning('Trace has not been successfully uploaded, status_code: ' + str(response.status_code))
-                break
-
-        client.close()
+                return
+            # acknowledged
+            meta_info.trace_cache_token = response.json()['cache_token']
+            meta_info.trace_cursor = batch_stop
+            # journal segments that have been uploaded can go
+            trace.compact(batch_stop)
+            meta_info.logger_trace.info('Uploading... %d/%d' % (total_num - (stop - batch_stop), total_num))
+        # the upload is complete, the next one starts a new cache
+        meta_info.trace_cache_token = ''
     except Exception as exc:
+        # get a fresh CSRF token next time
+        meta_info.trace_client.headers.pop('X-CSRFToken', None)
         meta_info.logger_trace.error('Upload terminated. ')
         meta_info.logger_trace.error(str(exc))
     else:
@@ -121,80 +86,157 @@ def upload_traces(meta_info: MetaInfo):
 
 
 ######## monitor the backend for update on rules and device monitors ########
+def _fingerprint(content: bytes):
+    return hashlib.sha1(content).hexdigest()
+
+
+def fetch_rules_and_devs(global_meta_info: MetaInfo, client, wait=None):
+    # get the rules and devs from the backend
+    # returns None if they have not changed since the last fetch:
+    # either the backend answers 304 to our ETag, or the body has the same fingerprint
+    # wait: ask the backend to hold the request for up to wait seconds until something changes
+    params = {"user_code": global_meta_info.user_code}
+    headers = {}
+    if global_meta_info.rule_etag is not None:
+        headers['If-None-Match'] = global_meta_info.rule_etag
+    timeout = global_meta_info.request_timeout
+    if wait:
+        params['wait'] = wait
+        timeout += wait
+    response = client.get(global_meta_info.rule_dev_url, params=params, headers=headers, timeout=timeout)
+    if response.status_code == 304:
+        return None
+    if not response:
+        raise Exception("Connection to backend failed: ", response.status_code)
+    global_meta_info.rule_etag = response.headers.get('ETag')
+    fingerprint = _fingerprint(response.content)
+    if fingerprint == global_meta_info.rule_dev_fingerprint:
+        return None
+    global_meta_info.rule_dev_fingerprint = fingerprint
+    return response.json()
+
+
+def install_rules(global_meta_info: MetaInfo, rule_list):
+    # build the new rule set aside and swap it in by reference,
+    # the monitor picks it up on its next tick without being blocked
+    # (the monitor carries the pending hold timers of kept rules over)
+    metrics = global_meta_info.metrics
+    wait_start = metrics.clock()
+    with global_meta_info.rule_lock:
+        metrics.lock_wait('rule_lock', metrics.clock() - wait_start)
+        global_meta_info.rule_set = RuleSet(rule_list, global_meta_info.rule_set.version + 1)
+        metrics.rule_installs += 1
+    global_meta_info.logger_rule.info('rule changed')
+    global_meta_info.logger_rule.info(str(rule_list))
+
+
+def update_rules_and_devs(global_meta_info: MetaInfo, response_json):
+    global_meta_info.rule_dev_json = response_json
+
+    # update location token
+    if response_json["loc_token"] != global_meta_info.loc_token:
+        global_meta_info.loc_token = response_json["loc_token"]
+
+    # update rules, only parsed if the rules themselves have changed
+    rules_fingerprint = _fingerprint(json.dumps(response_json['rules'], sort_keys=True).encode())
+    if rules_fingerprint != global_meta_info.rules_fingerprint:
+        rule_list = json_to_rule_list(response_json)
+        global_meta_info.rules_fingerprint = rules_fingerprint
+        install_rules(global_meta_info, rule_list)
+
+    # names of the devices, recorded with the trace entries of this tenant
+    global_meta_info.dev_names.update(json_to_dev_names(response_json))
+
+    # update devs
+    # currently disabled since we do not need to monitor devices during the interview
+    # dev_set = json_to_dev_set(response_json)
+    # monitored_devs = {key: None for key in dev_set}
+    # if monitored_devs != global_meta_info.monitored_devs:
+    #     with global_meta_info.monitored_dev_lock:
+    #         global_meta_info.monitored_devs = monitored_devs
+    #     print('Devices monitored: ', dev_set)
+
+
 def rule_dev_monitor(global_meta_info: MetaInfo):
-    data = {"user_code": global_meta_info.user_code}
+    client = requests.session()
     while not global_meta_info.exit_flag:
-        response = requests.get(global_meta_info.rule_dev_url, params=data)
-        response_json = response.json()
-        if response:
-            rule_list = json_to_rule_list(response_json)
-            dev_set = json_to_dev_set(response_json)
-        else:
-            raise Exception("Connection to backend failed: ", response.status_code)
+        started = time.monotonic()
+        response_json = fetch_rules_and_devs(global_meta_info, client, global_meta_info.rule_long_poll)
+        if response_json is not None:
+            update_rules_and_devs(global_meta_info, response_json)
 
-        # update location token
-        if response_json["loc_token"] != global_meta_info.loc_token:
-            global_meta_info.loc_token = response_json["loc_token"]
-        
         # upload trace if needed
-        if response_json["loc_token"] == global_meta_info.loc_token and response_json["pending_trace"]:
+        last_json = global_meta_info.rule_dev_json
+        if last_json["loc_token"] == global_meta_info.loc_token and last_json["pending_trace"]:
             upload_traces(global_meta_info)
-        
-        # update rules
-        if rule_list != global_meta_info.rule_list:
-            with global_meta_info.rule_lock:
-                global_meta_info.rule_list = rule_list
-                with global_meta_info.status_lock:
-                    # we clear the scheduled rules once rule list changes
-                    global_meta_info.rule_scheduled = dict()
-            global_meta_info.logger_rule.info('rule changed')
-            global_meta_info.logger_rule.info(str(rule_list))
-        
-        # update devs
-        # currently disabled since we do not need to monitor devices during the interview
-        # monitored_devs = {key: None for key in dev_set}
-        # if monitored_devs != global_meta_info.monitored_devs:
-        #     with global_meta_info.monitored_dev_lock:
-        #         global_meta_info.monitored_devs = monitored_devs
-        #     print('Devices monitored: ', dev_set)
-        
-        time.sleep(2)
+
+        if global_meta_info.rule_long_poll is None:
+            time.sleep(global_meta_info.rule_poll_interval)
+        else:
+            # a long poll returns as soon as something changes; if the backend
+            # answered "unchanged" right away, it does not hold requests, so
+            # we fall back to the regular interval
+            elapsed = time.monotonic() - started
+            if response_json is None and elapsed < global_meta_info.rule_poll_interval:
+                time.sleep(global_meta_info.rule_poll_interval - elapsed)
+    client.close()
 
 
 ######## send device status to backend ########
-def monitor_status_change(dev, val, global_meta_info: MetaInfo):
-    if dev in global_meta_info.monitored_devs:
-        with global_meta_info.monitored_dev_lock:
-            global_meta_info.monitored_devs[dev] = val
-            global_meta_info.monitored_devs_updated = True
-
-
-def generate_monitor_data(global_meta_info: MetaInfo):
-    data = []
-    for dev in global_meta_info.monitored_devs:
-        val = global_meta_info.monitored_devs[dev]
-        entry = {
-            'dev_datatype': dev.datatype,
-            'dev_typ': dev.typ,
-            'dev_address': dev.address,
-            'dev_name': dev.name,
-            'val': val
+def push_monitored_status(global_meta_info: MetaInfo, client):
+    # send the monitored devices changed since the last acknowledged push
+    # each push carries a sequence number; a push with 'full' carries all monitored
+    # devices, and is sent when the backend answers {'resync': true} (e.g., after a gap)
+    # the lock is only held to take the pending changes, not during the POST
+    drain_monitor_queue(global_meta_info)
+    with global_meta_info.monitored_dev_lock:
+        if not global_meta_info.monitored_devs_updated and not \
+           (global_meta_info.status_push_resync and global_meta_info.monitored_devs):
+            return
+        full = global_meta_info.status_push_resync
+        sent = global_meta_info.monitored_devs_pending
+        global_meta_info.monitored_devs_pending = dict()
+        global_meta_info.monitored_devs_updated = False
+        seq = global_meta_info.status_push_seq + 1
+        data = {
+            'update': generate_monitor_data(global_meta_info, None if full else sent),
+            'token': global_meta_info.loc_token,
+            'seq': seq,
+            'full': full
         }
-        data.append(entry)
-    return data
+    acked = False
+    try:
+        ensure_csrf(global_meta_info, client)
+        response = client.post(global_meta_info.update_monitor_url, json=data, timeout=global_meta_info.request_timeout)
+        acked = response.status_code == 200
+    finally:
+        with global_meta_info.monitored_dev_lock:
+            if acked:
+                global_meta_info.status_push_seq = seq
+                reply = _json_or_empty(response)
+                global_meta_info.status_push_resync = isinstance(reply, dict) and bool(reply.get('resync'))
+            else:
+                # keep the changes for the next push, newer values win
+                for dev in sent:
+                    if dev not in global_meta_info.monitored_devs_pending:
+                        global_meta_info.monitored_devs_pending[dev] = sent[dev]
+                global_meta_info.monitored_devs_updated = True
+    if acked:
+        global_meta_info.logger_monitor.info('device status sent (seq %d, %d devices)' % (seq, len(data['update'])))
+    else:
+        global_meta_info.logger_monitor.warning('device status push failed, status_code: ' + str(response.status_code))
+
+
+def _json_or_empty(response):
+    try:
+        return response.json()
+    except ValueError:
+        return dict()
 
 
 def status_update_to_backend(global_meta_info: MetaInfo):
     client = requests.session()
-    response = client.get(global_meta_info.cookie_url)
-    headers = {}
-    headers['X-CSRFToken'] = response.cookies['csrftoken']
     while not global_meta_info.exit_flag:
-        if global_meta_info.monitored_devs_updated:
-            with global_meta_info.monitored_dev_lock:
-                data = {'update': generate_monitor_data(global_meta_info), 'token': global_meta_info.loc_token}
-                response = client.post(global_meta_info.update_monitor_url, json=data, headers=headers)
-                global_meta_info.monitored_devs_updated = False
-            global_meta_info.logger_monitor.info('device status sent')
-        time.sleep(1)
-    client.close()
\ No newline at end of file
+        push_monitored_status(global_meta_info, client)
+        time.sleep(global_meta_info.status_push_window)
+    client.close()
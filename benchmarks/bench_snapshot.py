@@ -0,0 +1,77 @@
+###################################################
+# compare per-device reads (one get_funcs call and one .Value
+# per device, as check_value_change used to do) with
+# block reads through snapshot.MemorySnapshot
+# on the simulated memory map (sim_memory)
+#
+# usage: python benchmarks/bench_snapshot.py [--ticks N] [--crossing-us US]
+###################################################
+import argparse
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from device import init_dev_list
+from snapshot import MemorySnapshot
+from memory_backend import load_memory_backend
+
+
+class SimMetaInfo(object):
+    # the parts of MetaInfo used by the snapshot, on the simulated memory map
+    def __init__(self, crossing_us):
+        memory_map, memory_type, _ = load_memory_backend('sim', crossing_us=crossing_us)
+        self.instance = memory_map.Instance
+        self.get_funcs = {datatype: getattr(self.instance, 'Get' + datatype) for datatype in ('Bit', 'Float')}
+        self.mem_types = {'Input': memory_type.Input, 'Output': memory_type.Output, 'Memory': memory_type.Memory}
+
+
+def per_device_read(meta_info, dev_list):
+    values = []
+    for dev in dev_list:
+        values.append(meta_info.get_funcs[dev.datatype](
+            dev.address, meta_info.mem_types[dev.typ]).Value)
+    return values
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ticks', type=int, default=2000)
+    parser.add_argument('--crossing-us', type=float, default=0.0,
+                        help='simulated cost of one pythonnet call in microseconds')
+    parser.add_argument('--changes', type=int, default=2,
+                        help='number of devices changed per tick')
+    args = parser.parse_args()
+
+    dev_list, _ = init_dev_list()
+    dev_list = [dev for dev in dev_list if dev.datatype in ('Bit', 'Float')]
+    meta_info = SimMetaInfo(args.crossing_us)
+    snapshot = MemorySnapshot(dev_list)
+    snapshot.bind(meta_info)
+    instance = meta_info.instance
+    memories = list(instance.memories.values())
+    rng = random.Random(0)
+
+    start = time.perf_counter()
+    for _ in range(args.ticks):
+        per_device_read(meta_info, dev_list)
+    per_device = (time.perf_counter() - start) / args.ticks
+
+    start = time.perf_counter()
+    for _ in range(args.ticks):
+        for memory in rng.sample(memories, args.changes):
+            instance.set_input(memory.MemoryType, memory.DataType, memory.Address,
+                               not memory._value if memory.DataType == 'Bit' else memory._value + 0.5)
+        instance.Update()
+        snapshot.changes()
+    bulk = (time.perf_counter() - start) / args.ticks
+
+    print('devices: %d, ticks: %d, crossing: %.1f us' % (len(dev_list), args.ticks, args.crossing_us))
+    print('per-device read:      %8.1f us/tick' % (per_device * 1e6))
+    print('snapshot read + diff: %8.1f us/tick' % (bulk * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,320 @@
+###################################################
+# benchmarks of the connector's hot paths on synthetic
+# houses and rule sets, from the size of the default house
+# (~300 devices, a handful of rules) up to 10k devices
+# and 5k rules, on the simulated memory map (sim_memory)
+#
+# the results are written as JSON, one record per
+# (benchmark, scale), so runs of different releases
+# can be compared
+#
+# usage: python benchmarks/bench_suite.py [--scales 300:5,10000:5000]
+#                                         [--ticks N] [--output results.json]
+###################################################
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from device import init_dev_list, input_bits
+from topology import Topology
+from memory_backend import load_memory_backend
+from meta import MetaInfo
+from monitor import check_value_change, _trigger_rule, _process_changes
+from actuator import trigger_rule
+from rule_decoder import RuleDecoder, json_to_rule_list
+from backend_monitor import install_rules, upload_traces
+from status import status_backends
+from traces import generate_trace_entry
+
+DEFAULT_SCALES = '300:5,1000:100,3000:1000,10000:5000'
+
+
+def synthetic_topology(num_devices):
+    # a house of about num_devices devices laid out like the default one:
+    # switches wired to lights (SS controllers) and shades (an openness
+    # sensor and a pair of motors each)
+    num_input_bits = num_devices * 45 // 100
+    num_input_floats = num_devices * 15 // 100
+    num_output_bits = num_devices * 25 // 100
+    num_output_floats = num_devices - num_input_bits - num_input_floats - num_output_bits - 1
+    num_shades = min(num_devices // 40, num_input_floats, num_output_bits // 4)
+    num_lights = num_output_bits - 2 * num_shades
+    data = {
+        'devices': {
+            'Input': {'Bit': list(range(num_input_bits)), 'Float': list(range(num_input_floats)),
+                      'DateTime': [0]},
+            'Output': {'Bit': list(range(num_output_bits)), 'Float': list(range(num_output_floats))},
+        },
+        'controllers': {
+            'ss': [{'switch': switch, 'outputs': [2 * num_shades + switch % num_lights]}
+                   for switch in range(num_input_bits // 4)],
+        },
+        'virtual_devices': {
+            'shade': [{'address': 100000 + i, 'openness': i, 'motors': [2 * i, 2 * i + 1]}
+                      for i in range(num_shades)],
+        },
+    }
+    return Topology(data)
+
+
+def _dev_json(typ, datatype, address):
+    return {'typ': typ, 'data_typ': datatype, 'address': address, 'name': '%s%s%d' % (typ, datatype, address)}
+
+
+def synthetic_rules_json(topology, num_rules, rng):
+    # rules in the format of the backend: mostly "if switch becomes true",
+    # some "has been true for x" and "if it becomes xx:xx", with up to two conditions
+    switches = topology.devices[('Input', 'Bit')]
+    sensors = topology.devices[('Input', 'Float')]
+    outputs = topology.devices[('Output', 'Bit')]
+    rules = []
+    for _ in range(num_rules):
+        kind = rng.random()
+        if kind < 0.1:
+            trigger = {'dev': _dev_json('m', 'dt', 65), 'comp': '=', 'hold_t': None,
+                       'val': '%02d:%02d' % (rng.randrange(24), rng.randrange(60))}
+        else:
+            trigger = {'dev': _dev_json('i', 'b', rng.choice(switches)), 'comp': '=',
+                       'val': rng.random() < 0.8, 'hold_t': rng.randrange(30, 600) if kind < 0.2 else None}
+        conditions = []
+        for _ in range(rng.randrange(3)):
+            if sensors and rng.random() < 0.5:
+                conditions.append({'dev': _dev_json('i', 'f', rng.choice(sensors)), 'comp': rng.choice(['<', '>=']),
+                                   'val': round(rng.uniform(0, 10), 1)})
+            else:
+                conditions.append({'dev': _dev_json('i', 'b', rng.choice(switches)), 'comp': '=',
+                                   'val': rng.random() < 0.5})
+        action = {'dev': _dev_json('o', 'b', rng.choice(outputs)), 'comp': '=', 'val': rng.random() < 0.5}
+        rules.append({'trigger': trigger, 'conditions': conditions, 'action': action})
+    return {'rules': rules}
+
+
+def make_meta_info(topology, status_backend):
+    memory_map, memory_type, handler = load_memory_backend('sim', start=datetime.datetime(2021, 1, 1, 8, 0, 0))
+    dev_list, virtual_dev_list = init_dev_list(topology)
+    meta_info = MetaInfo(memory_map, memory_type, handler, dev_list, virtual_dev_list, [], 'bench', 'localhost',
+                         status_backend=status_backend, topology=topology)
+    for logger in (meta_info.logger_rule, meta_info.logger_monitor, meta_info.logger_trace):
+        logger.setLevel(logging.WARNING)
+    return meta_info
+
+
+def _record(results, name, scale, ops, seconds, **extra):
+    record = {
+        'benchmark': name,
+        'devices': scale[0],
+        'rules': scale[1],
+        'ops': ops,
+        'seconds': seconds,
+        'us_per_op': seconds / ops * 1e6 if ops else None,
+    }
+    record.update(extra)
+    results.append(record)
+    print('%-28s %6d devs %5d rules %12.2f us/op  (%d ops)' % (
+        name + ''.join(' %s=%s' % item for item in sorted(extra.items())), scale[0], scale[1],
+        record['us_per_op'] or 0.0, ops))
+
+
+def bench_check_value_change(results, scale, topology, rules_json, status_backend, ticks, changes, rng):
+    meta_info = make_meta_info(topology, status_backend)
+    instance = meta_info.memory_map.Instance
+    inputs = [dev for dev in meta_info.dev_list if dev.typ == 'Input' and dev.datatype in ('Bit', 'Float')]
+    # the first tick reads every device, the rules come in once the status is known
+    check_value_change(meta_info)
+    install_rules(meta_info, json_to_rule_list(rules_json))
+    elapsed = 0.0
+    for _ in range(ticks):
+        for dev in rng.sample(inputs, min(changes, len(inputs))):
+            val = rng.random() < 0.5 if dev.datatype == 'Bit' else rng.uniform(0, 10)
+            instance.set_input(dev.typ, dev.datatype, dev.address, val)
+        instance.advance(1)
+        start = time.perf_counter()
+        check_value_change(meta_info)
+        elapsed += time.perf_counter() - start
+        instance.writes = []
+    _record(results, 'check_value_change', scale, ticks, elapsed,
+            status_backend=status_backend, changes_per_tick=changes)
+    return meta_info
+
+
+def bench_full_poll(results, scale, meta_info, status_backend, ops):
+    # the reconciliation poll of the event capture mode: every device is read and
+    # compared with the status, nothing changed since the last tick
+    snapshot = meta_info.snapshot
+    rule_set = meta_info.rule_set
+    time_val = meta_info.status.check_time()
+    status = meta_info.status
+    start = time.perf_counter()
+    for _ in range(ops):
+        _process_changes(meta_info, rule_set, time_val, snapshot.current(None, status))
+    elapsed = time.perf_counter() - start
+    _record(results, 'full_poll', scale, ops * len(snapshot.index), elapsed, status_backend=status_backend)
+
+
+def bench_trigger_rule_per_change(results, scale, meta_info, ops, rng):
+    rule_set = meta_info.rule_set
+    triggers = list(rule_set.index.edge) + list(rule_set.index.hold) or [input_bits[0]]
+    time_val = meta_info.status.check_time()
+    calls = [(rng.choice(triggers), rng.random() < 0.5) for _ in range(ops)]
+    start = time.perf_counter()
+    for dev, val in calls:
+        _trigger_rule(meta_info, rule_set, time_val, dev, val, not val)
+    elapsed = time.perf_counter() - start
+    meta_info.write_buffer.pending = dict()
+    _record(results, '_trigger_rule', scale, ops, elapsed)
+
+
+def bench_trigger_rule_conditions(results, scale, meta_info, ops, rng):
+    rules = [rule for rule in meta_info.rule_set.rules if rule.condition]
+    if not rules:
+        return
+    calls = [rng.choice(rules) for _ in range(ops)]
+    start = time.perf_counter()
+    for rule in calls:
+        trigger_rule(rule, meta_info)
+    elapsed = time.perf_counter() - start
+    meta_info.write_buffer.pending = dict()
+    _record(results, 'trigger_rule', scale, ops, elapsed)
+
+
+def bench_json_to_rule_list(results, scale, rules_json, repeat):
+    # cold: every rule is new, warm: the same rules come back in the next poll
+    decoders = [RuleDecoder() for _ in range(repeat)]
+    start = time.perf_counter()
+    for decoder in decoders:
+        decoder.decode_list(rules_json)
+    elapsed = time.perf_counter() - start
+    _record(results, 'json_to_rule_list', scale, repeat * len(rules_json['rules']), elapsed, cache='cold')
+
+    decoder = decoders[0]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        decoder.decode_list(rules_json)
+    elapsed = time.perf_counter() - start
+    _record(results, 'json_to_rule_list', scale, repeat * len(rules_json['rules']), elapsed, cache='warm')
+
+
+def bench_compare_status(results, scale, meta_info, ops, rng):
+    devs = [dev for dev in meta_info.dev_list if dev.datatype in ('Bit', 'Float')]
+    calls = [(dev, rng.random() < 0.5 if dev.datatype == 'Bit' else rng.uniform(0, 10))
+             for dev in (rng.choice(devs) for _ in range(ops))]
+    for name, status_class in sorted(status_backends.items()):
+        status = status_class(meta_info.dev_list, meta_info.virtual_dev_list)
+        for dev, val in calls[:len(devs)]:
+            status.update_status(dev, val)
+        compare_status = status.compare_status
+        start = time.perf_counter()
+        for dev, val in calls:
+            compare_status(dev, val)
+        elapsed = time.perf_counter() - start
+        _record(results, 'compare_status', scale, ops, elapsed, status_backend=name)
+
+
+def bench_generate_trace_entry(results, scale, meta_info, ops, rng):
+    devs = meta_info.dev_list
+    timestamp = datetime.datetime(2021, 1, 1, 8, 0, 0)
+    calls = [(rng.choice(devs), rng.random() < 0.5) for _ in range(ops)]
+    start = time.perf_counter()
+    for dev, val in calls:
+        generate_trace_entry(dev, val, timestamp)
+    elapsed = time.perf_counter() - start
+    _record(results, 'generate_trace_entry', scale, ops, elapsed)
+
+
+class _UploadResponse(object):
+    status_code = 200
+
+    def json(self):
+        return {'cache_token': 'bench'}
+
+
+class _UploadClient(object):
+    # accepts every batch, serializing it as requests would
+    def __init__(self):
+        self.headers = {'X-CSRFToken': 'bench'}
+        self.posts = 0
+        self.bytes = 0
+
+    def post(self, url, json=None, timeout=None):
+        self.posts += 1
+        self.bytes += len(_dumps(json))
+        return _UploadResponse()
+
+
+_dumps = json.dumps
+
+
+def bench_upload_traces(results, scale, meta_info, entries, rng):
+    trace = meta_info.trace
+    devs = meta_info.dev_list
+    timestamp = datetime.datetime(2021, 1, 1, 8, 0, 0)
+    for i in range(entries):
+        trace.record(rng.choice(devs), rng.random() < 0.5, timestamp + datetime.timedelta(seconds=i))
+    meta_info.trace_cursor = trace.oldest_seq
+    client = _UploadClient()
+    meta_info.trace_client = client
+    start = time.perf_counter()
+    upload_traces(meta_info)
+    elapsed = time.perf_counter() - start
+    _record(results, 'upload_traces', scale, entries, elapsed,
+            batchsize=meta_info.upload_batchsize, batches=client.posts)
+
+
+def run_scale(results, scale, args):
+    num_devices, num_rules = scale
+    rng = random.Random(args.seed)
+    topology = synthetic_topology(num_devices)
+    rules_json = synthetic_rules_json(topology, num_rules, rng)
+
+    meta_info = None
+    for status_backend in ('dict', 'array'):
+        meta_info = bench_check_value_change(results, scale, topology, rules_json, status_backend,
+                                             args.ticks, args.changes, rng)
+        bench_full_poll(results, scale, meta_info, status_backend, max(1, args.ticks // 10))
+    bench_trigger_rule_per_change(results, scale, meta_info, args.ops, rng)
+    bench_trigger_rule_conditions(results, scale, meta_info, args.ops, rng)
+    bench_json_to_rule_list(results, scale, rules_json, max(1, args.ops // max(num_rules, 1)))
+    bench_compare_status(results, scale, meta_info, args.ops, rng)
+    bench_generate_trace_entry(results, scale, meta_info, args.ops, rng)
+    bench_upload_traces(results, scale, meta_info, args.trace_entries, rng)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scales', default=DEFAULT_SCALES,
+                        help='comma separated devices:rules pairs')
+    parser.add_argument('--ticks', type=int, default=200, help='ticks timed by check_value_change')
+    parser.add_argument('--changes', type=int, default=5, help='input changes per tick')
+    parser.add_argument('--ops', type=int, default=20000, help='calls timed by the other benchmarks')
+    parser.add_argument('--trace-entries', type=int, default=20000, help='trace entries uploaded')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_results.json')
+    args = parser.parse_args()
+
+    scales = [tuple(int(part) for part in scale.split(':')) for scale in args.scales.split(',')]
+    results = []
+    for scale in scales:
+        run_scale(results, scale, args)
+
+    report = {
+        'time': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'args': vars(args),
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('results written to %s' % args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,36 +1,11 @@
 from typing import get_origin
 import requests
 import time
+import queue
 import logging
 
 from meta import MetaInfo
-from device import Device
-
-typ_map = {
-    'o': 'Output',
-    'i': 'Input',
-    'm': 'Memory'
-}
-
-datatype_map = {
-    'b': 'Bit',
-    'f': 'Float',
-    'dt': 'DateTime'
-}
-
-
-def json_to_dev_set(response_json):
-    dev_set = set()
-    for dev_json in response_json['devs']:
-        dev = Device(
-            typ_map[dev_json['typ']], 
-            datatype_map[dev_json['data_typ']], 
-            int(dev_json['address']), 
-            dev_json['name']
-        )
-        dev_set.add(dev)
-
-    return dev_set
+from rule_decoder import json_to_dev_set
 
 
 def init_device_monitors(global_meta_info: MetaInfo):
@@ -44,25 +19,48 @@ def init_device_monitors(global_meta_info: MetaInfo):
     
     with global_meta_info.monitored_dev_lock:
         global_meta_info.monitored_devs = {key: None for key in dev_set}
+        global_meta_info.monitored_devs_pending = dict()
+        # the backend needs the full set of monitored devices again
+        global_meta_info.status_push_resync = True
         global_meta_info.logger_monitor.info('Devices monitored: ' + str(dev_set))
 
 
+# called from the monitor thread: only hand the change over through the queue,
+# the network side applies it to monitored_devs (see drain_monitor_queue)
 def monitor_status_change(dev, val, global_meta_info: MetaInfo):
     if dev in global_meta_info.monitored_devs:
-        with global_meta_info.monitored_dev_lock:
-            global_meta_info.monitored_devs[dev] = val
-            global_meta_info.monitored_devs_updated = True
+        global_meta_info.monitor_queue.put((dev, val))
+
+
+# apply the queued changes to monitored_devs, returns whether anything needs to be sent
+def drain_monitor_queue(global_meta_info: MetaInfo):
+    with global_meta_info.monitored_dev_lock:
+        while True:
+            try:
+                dev, val = global_meta_info.monitor_queue.get_nowait()
+            except queue.Empty:
+                break
+            if dev in global_meta_info.monitored_devs:
+                global_meta_info.monitored_devs[dev] = val
+                # coalesced: only the last value of a device is pushed
+                global_meta_info.monitored_devs_pending[dev] = val
+                global_meta_info.monitored_devs_updated = True
+        return global_meta_info.monitored_devs_updated
 
 
-def generate_monitor_data(global_meta_info: MetaInfo):
+# devs: {dev: val} to send, all monitored devices by default
+def generate_monitor_data(global_meta_info: MetaInfo, devs=None):
+    if devs is None:
+        devs = global_meta_info.monitored_devs
     data = []
-    for dev in global_meta_info.monitored_devs:
-        val = global_meta_info.monitored_devs[dev]
+    dev_names = global_meta_info.dev_names
+    for dev in devs:
+        val = devs[dev]
         entry = {
             'dev_datatype': dev.datatype,
             'dev_typ': dev.typ,
             'dev_address': dev.address,
-            'dev_name': dev.name,
+            'dev_name': dev_names.get(dev, ''),
             'val': val
         }
         data.append(entry)
@@ -75,7 +73,7 @@ def device_monitor(global_meta_info: MetaInfo):
     headers = {}
     headers['X-CSRFToken'] = response.cookies['csrftoken']
     while not global_meta_info.exit_flag:
-        if global_meta_info.monitored_devs_updated:
+        if drain_monitor_queue(global_meta_info):
             with global_meta_info.monitored_dev_lock:
                 data = {'update': generate_monitor_data(global_meta_info), 'token': global_meta_info.loc_token}
                 response = client.post(global_meta_info.update_monitor_url, json=data, headers=headers)
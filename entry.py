@@ -1,50 +1,80 @@
+import argparse
 import threading
-import clr
 import time
 
-clr.AddReference('EngineIO')
-from EngineIO import *
-
 from monitor import monitor
 # from rule_monitor import rule_monitor
 # from dev_monitor import device_monitor, init_device_monitors
-from backend_monitor import rule_dev_monitor, status_update_to_backend
+# from backend_monitor import rule_dev_monitor, status_update_to_backend
+from network import NetworkRuntime
 from meta import MetaInfo
 from device import Device, init_dev_list
+from memory_backend import memory_backends, load_memory_backend
+from metrics import MetricsServer
 # from traces import upload_traces
 
 
+parser = argparse.ArgumentParser(description='Home I/O connector for TapDebug')
+parser.add_argument('--backend', choices=sorted(memory_backends), default='engineio',
+                    help="memory map backend: 'engineio' (Home I/O) or 'sim' (simulated house)")
+parser.add_argument('--sim-script', default=None,
+                    help='JSON script of input changes for the sim backend')
+parser.add_argument('--sim-time-scale', type=float, default=1.0,
+                    help='speed of the simulated clock of the sim backend')
+parser.add_argument('--server-url', default=None)
+parser.add_argument('--user-code', default=None)
+parser.add_argument('--status-backend', choices=['dict', 'array'], default='dict')
+parser.add_argument('--capture', choices=['poll', 'event'], default='poll')
+parser.add_argument('--journal', default=None,
+                    help='directory to journal trace entries to')
+parser.add_argument('--metrics-port', type=int, default=None,
+                    help='serve metrics in Prometheus format on 127.0.0.1:<port>/metrics')
+args = parser.parse_args()
+
+MemoryMap, MemoryType, MemoriesChangedEventHandler = load_memory_backend(
+    args.backend, time_scale=args.sim_time_scale, script=args.sim_script)
+
 rule_list = []
 dev_list, virtual_dev_list = init_dev_list()
 
-print("Enter the TapDebug server url: ")
-print("(e.g., tapdebug.cs.uchicago.edu)")
-server_url = input("Server url: ")
+server_url = args.server_url
+if server_url is None:
+    print("Enter the TapDebug server url: ")
+    print("(e.g., tapdebug.cs.uchicago.edu)")
+    server_url = input("Server url: ")
 
-user_code = input("Enter the user code: ")
+user_code = args.user_code
+if user_code is None:
+    user_code = input("Enter the user code: ")
 
 global_meta_info = MetaInfo(
-    MemoryMap, MemoryType, MemoriesChangedEventHandler, dev_list, virtual_dev_list, rule_list, user_code, server_url)
+    MemoryMap, MemoryType, MemoriesChangedEventHandler, dev_list, virtual_dev_list, rule_list, user_code, server_url,
+    status_backend=args.status_backend, journal_dir=args.journal)
+global_meta_info.capture_mode = args.capture
+
+metrics_server = None
+if args.metrics_port is not None:
+    metrics_server = MetricsServer(global_meta_info.metrics, port=args.metrics_port)
+    metrics_server.start()
 
 monitor_thread = threading.Thread(
     target=monitor, args=(global_meta_info,))
 monitor_thread.start()
 
-backend_monitor_thread = threading.Thread(
-    target=rule_dev_monitor, args=(global_meta_info,))
-backend_monitor_thread.start()
-
-dev_update_thread = threading.Thread(
-    target=status_update_to_backend, args=(global_meta_info,))
-dev_update_thread.start()
+# rule polling, monitored-status push and trace upload
+network_runtime = NetworkRuntime(global_meta_info)
+network_thread = threading.Thread(target=network_runtime.run)
+network_thread.start()
 
 while True:
     s = input("Input 'q' to exit: \n")
     if s == 'q':
         global_meta_info.exit_flag = True
         monitor_thread.join()
-        backend_monitor_thread.join()
-        dev_update_thread.join()
+        network_thread.join()
+        global_meta_info.trace.close()
+        if metrics_server is not None:
+            metrics_server.stop()
         # upload traces
         # upload_traces(global_meta_info)
         break
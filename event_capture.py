@@ -0,0 +1,70 @@
+import time
+
+from meta import MetaInfo
+
+
+###################################################
+# capture device changes from the memory map events
+# (InputsValueChanged/OutputsValueChanged) instead of
+# reading every device on every tick.
+# Home I/O raises those events from inside
+# memory_map.Instance.Update(), on the calling thread,
+# so the changes are collected while memory_map_lock
+# is held and drained by the same tick.
+###################################################
+class EventCapture(object):
+    def __init__(self, meta_info: MetaInfo):
+        self.meta_info = meta_info
+        self.dev_map = {(dev.typ, dev.datatype, dev.address): dev
+                        for dev in meta_info.dev_list if dev.datatype in ('Bit', 'Float')}
+        # [(dev, val)] reported since the last drain
+        self.pending = []
+        self.handlers = dict()
+        # None until the first full poll, which initializes the status
+        self.last_reconciled = None
+        self.reconciled = 0
+        # number of changes found by a reconciliation poll instead of an event
+        self.missed = 0
+
+    def _make_handler(self, typ):
+        def on_value_changed(sender, value):
+            dev_map = self.dev_map
+            for memory in value.MemoriesBit:
+                dev = dev_map.get((typ, 'Bit', memory.Address))
+                if dev is not None:
+                    self.pending.append((dev, memory.Value))
+            for memory in value.MemoriesFloat:
+                dev = dev_map.get((typ, 'Float', memory.Address))
+                if dev is not None:
+                    self.pending.append((dev, memory.Value))
+        return self.meta_info.memories_changed_event_handler(on_value_changed)
+
+    def subscribe(self):
+        instance = self.meta_info.memory_map.Instance
+        self.handlers['Input'] = self._make_handler('Input')
+        self.handlers['Output'] = self._make_handler('Output')
+        instance.InputsValueChanged += self.handlers['Input']
+        instance.OutputsValueChanged += self.handlers['Output']
+
+    def unsubscribe(self):
+        instance = self.meta_info.memory_map.Instance
+        if 'Input' in self.handlers:
+            instance.InputsValueChanged -= self.handlers['Input']
+        if 'Output' in self.handlers:
+            instance.OutputsValueChanged -= self.handlers['Output']
+        self.handlers = dict()
+
+    def drain(self):
+        pending = self.pending
+        self.pending = []
+        return pending
+
+    def reconcile_due(self):
+        # a slow full poll catches changes whose events were lost
+        now = time.monotonic()
+        if self.last_reconciled is None or \
+           now - self.last_reconciled >= self.meta_info.reconcile_interval:
+            self.last_reconciled = now
+            self.reconciled += 1
+            return True
+        return False
@@ -0,0 +1,171 @@
+import json
+import os
+import struct
+from array import array
+
+from device import Device
+
+# one trace entry: device (memory type code, datatype code, address),
+# value, epoch seconds, automated flag, name id
+RECORD = struct.Struct('<BBiddbi')
+SEGMENT_SUFFIX = '.trace'
+# the names of the entries, one JSON string per line (the line after the
+# first is name id 1, name id 0 is '')
+NAMES_FILE = 'names'
+# sequence number of the first entry not acknowledged by the server
+ACKED_FILE = 'acked'
+
+# codes of the memory types and datatypes in records (append only)
+TYPES = ('Input', 'Output', 'Memory')
+DATATYPES = ('Bit', 'Byte', 'Short', 'Int', 'Long', 'Float', 'Double', 'String', 'DateTime', 'TimeSpan')
+TYPE_CODES = {typ: i for i, typ in enumerate(TYPES)}
+DATATYPE_CODES = {datatype: i for i, datatype in enumerate(DATATYPES)}
+
+
+###################################################
+# append-only, segment-rotated journal of trace entries
+# Each segment is a file named after the sequence number
+# of its first entry and holds fixed-size records, so an
+# entry is found from its sequence number alone.
+# Segments left by a previous run are picked up again
+# (a partially written last record is cut off), so a crash
+# does not lose the entries that have not been uploaded.
+# Records name their device by (memory type, datatype,
+# address) rather than by its slot, which depends on the
+# devices of the process, and the upload progress (acked)
+# is kept next to the segments, so a restart neither
+# misreads nor uploads again the entries of a previous run.
+# This should be guarded with the lock of the TraceStore
+###################################################
+class TraceJournal(object):
+    def __init__(self, directory, segment_entries=65536, buffer_size=64 * 1024):
+        self.directory = directory
+        self.segment_entries = segment_entries
+        self.buffer_size = buffer_size
+        os.makedirs(directory, exist_ok=True)
+
+        # [[first seq, number of entries, path]], oldest first
+        self.segments = []
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(SEGMENT_SUFFIX):
+                continue
+            path = os.path.join(directory, name)
+            size = os.path.getsize(path)
+            if size % RECORD.size:
+                size -= size % RECORD.size
+                with open(path, 'r+b') as f:
+                    f.truncate(size)
+            self.segments.append([int(name[:-len(SEGMENT_SUFFIX)]), size // RECORD.size, path])
+        self.segments.sort()
+
+        # names by name id, a name is written before the first entry using it
+        self.names = ['']
+        names_path = os.path.join(directory, NAMES_FILE)
+        if os.path.exists(names_path):
+            with open(names_path, 'r+b') as f:
+                data = f.read()
+                # a partially written last line is cut off
+                data = data[:data.rfind(b'\n') + 1]
+                f.truncate(len(data))
+            self.names.extend(json.loads(line) for line in data.decode().splitlines())
+        self.names_file = open(names_path, 'a')
+
+        self.acked_path = os.path.join(directory, ACKED_FILE)
+        self.acked_seq = 0
+        if os.path.exists(self.acked_path):
+            with open(self.acked_path) as f:
+                self.acked_seq = int(f.read() or 0)
+        # the numbering goes on after the entries of the previous runs, even when
+        # all their segments have been uploaded and deleted
+        end = self.segments[-1][0] + self.segments[-1][1] if self.segments else 0
+        self.next_seq = max(end, self.acked_seq)
+
+        # the segment being written
+        self.file = None
+        self.dirty = False
+
+    @property
+    def first_seq(self):
+        return self.segments[0][0] if self.segments else self.next_seq
+
+    def _open_segment(self):
+        path = os.path.join(self.directory, '%016d%s' % (self.next_seq, SEGMENT_SUFFIX))
+        self.file = open(path, 'ab', buffering=self.buffer_size)
+        self.segments.append([self.next_seq, 0, path])
+
+    def add_name(self, name):
+        self.names.append(name)
+        self.names_file.write(json.dumps(name) + '\n')
+        self.names_file.flush()
+
+    def append(self, dev: Device, val, epoch, automated, name_id):
+        if self.file is None or self.segments[-1][1] >= self.segment_entries:
+            self._close_segment()
+            self._open_segment()
+        self.file.write(RECORD.pack(TYPE_CODES[dev.typ], DATATYPE_CODES[dev.datatype], dev.address,
+                                    val, epoch, automated, name_id))
+        self.segments[-1][1] += 1
+        self.next_seq += 1
+        self.dirty = True
+
+    def flush(self):
+        if self.dirty:
+            self.file.flush()
+            self.dirty = False
+
+    def _close_segment(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.dirty = False
+
+    def close(self):
+        self._close_segment()
+        self.names_file.close()
+
+    def read(self, start, stop):
+        # columns (devices, values, epochs, automated, name ids) of the entries [start, stop)
+        self.flush()
+        devs, values, epochs, automated, name_ids = [], array('d'), array('d'), array('b'), array('i')
+        # {(memory type code, datatype code, address): device}
+        keys = dict()
+        for first, count, path in self.segments:
+            begin = max(start, first)
+            end = min(stop, first + count)
+            if begin >= end:
+                continue
+            with open(path, 'rb') as f:
+                f.seek((begin - first) * RECORD.size)
+                data = f.read((end - begin) * RECORD.size)
+            for typ, datatype, address, val, epoch, is_automated, name_id in RECORD.iter_unpack(data):
+                key = (typ, datatype, address)
+                dev = keys.get(key)
+                if dev is None:
+                    dev = keys[key] = Device(TYPES[typ], DATATYPES[datatype], address)
+                devs.append(dev)
+                values.append(val)
+                epochs.append(epoch)
+                automated.append(is_automated)
+                name_ids.append(name_id)
+        return devs, values, epochs, automated, name_ids
+
+    def ack(self, seq):
+        # entries before seq have been uploaded, written to a new file and
+        # renamed over the old one, so the file always holds a whole number
+        if seq <= self.acked_seq:
+            return
+        tmp_path = self.acked_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(str(seq))
+        os.replace(tmp_path, self.acked_path)
+        self.acked_seq = seq
+
+    def compact(self, seq):
+        # delete the segments whose entries are all before seq (e.g., uploaded),
+        # except the one being written
+        while len(self.segments) > (1 if self.file is not None else 0):
+            first, count, path = self.segments[0]
+            if first + count > seq:
+                break
+            os.remove(path)
+            self.segments.pop(0)
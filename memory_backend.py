@@ -0,0 +1,32 @@
+###################################################
+# memory map backends
+# a backend provides the three objects MetaInfo takes:
+# (memory map, memory type, memories changed event handler)
+#   'engineio': Home I/O through EngineIO.dll (pythonnet, Windows)
+#   'sim':      the in-process simulation of sim_memory
+###################################################
+def load_engineio(**kwargs):
+    import clr
+    clr.AddReference('EngineIO')
+    from EngineIO import MemoryMap, MemoryType, MemoriesChangedEventHandler
+    return MemoryMap, MemoryType, MemoriesChangedEventHandler
+
+
+def load_sim(start=None, time_scale=None, script=None, crossing_us=0.0, **kwargs):
+    from sim_memory import SimMemoryMap, SimInstance, SimMemoryType, SimMemoriesChangedEventHandler
+    instance = SimInstance(start, time_scale, crossing_us)
+    if script is not None:
+        instance.load_script(script)
+    return SimMemoryMap(instance), SimMemoryType, SimMemoriesChangedEventHandler
+
+
+memory_backends = {
+    'engineio': load_engineio,
+    'sim': load_sim,
+}
+
+
+def load_memory_backend(name, **kwargs):
+    if name not in memory_backends:
+        raise Exception("unknown memory map backend %s." % name)
+    return memory_backends[name](**kwargs)
@@ -1,11 +1,21 @@
 import threading
+import queue
 import logging
 
-from status import Status
+from status import status_backends
+from rule import RuleSet
+from snapshot import MemorySnapshot
+from traces import TraceStore
+from journal import TraceJournal
+from topology import default_topology
+from write_buffer import WriteBuffer
+from metrics import Metrics
 
 class MetaInfo(object):
     def __init__(self, memory_map, memory_type, memories_changed_event_handler, 
-                 dev_list, virtual_dev_list, rule_list, user_code, server_url):
+                 dev_list, virtual_dev_list, rule_list, user_code, server_url,
+                 status_backend='dict', trace_capacity=None, trace_overflow='overwrite',
+                 journal_dir=None, topology=None, tenant=None):
         
         ### Objects to communicate with Home I/O ###
         # When used, should guard with memory_map_lock
@@ -13,6 +23,17 @@ class MetaInfo(object):
         self.memory_type = memory_type
         self.memories_changed_event_handler = memories_changed_event_handler
         self.memory_map_lock = threading.Lock()
+        # reads the memory map block by block (bound on the first tick)
+        # When used, should guard with memory_map_lock
+        self.snapshot = MemorySnapshot(dev_list)
+        # how device changes are captured:
+        # 'poll' reads every device on each tick,
+        # 'event' collects InputsValueChanged/OutputsValueChanged events raised by Update()
+        #   and falls back to a full poll every reconcile_interval seconds
+        self.capture_mode = 'poll'
+        self.reconcile_interval = 5.0
+        # set by monitor() when capture_mode is 'event'
+        self.event_capture = None
 
         ### List of devices (static) ###
         self.dev_list = dev_list
@@ -20,28 +41,43 @@ class MetaInfo(object):
         # abstracted from shades/garage doors)
         self.virtual_dev_list = virtual_dev_list
         self.virtual_dev_set = set(virtual_dev_list)
-
-        ### List of TAP rules ###
-        # When used, should guard with rule_lock
-        self.rule_list = rule_list
+        # {virtual device: None} of the virtual devices to recompute at the end of the tick
+        # (see default_controller.mark_dependent_virtual_devices), all of them at first
+        self.virtual_dev_dirty = dict.fromkeys(virtual_dev_list)
+        # the house topology the devices come from (see topology.py)
+        self.topology = topology if topology is not None else default_topology()
+        # dispatch table of the default controllers, compiled from the topology
+        # on first use (see default_controller.compile_dispatch)
+        self.controller_dispatch = None
+        # memory map writes of the current tick, flushed with one Update() by the monitor
+        # When used, should guard with memory_map_lock
+        self.write_buffer = WriteBuffer(self.topology.motor_interlocks())
+
+        ### TAP rules ###
+        # the installed rules (see RuleSet), replaced as a whole when rules change
+        # the monitor reads it without locking
+        self.rule_set = RuleSet(rule_list)
+        # the rule set used by the last monitor tick, only touched by the monitor
+        self.active_rule_set = self.rule_set
+        # serializes rule installs, never taken by the monitor
         self.rule_lock = threading.Lock()
 
         ### List of monitored devices ###
         # When used, should guard with monitored_dev_lock
         self.monitored_devs = dict()
+        # {dev: val} changed since the last acknowledged push
+        self.monitored_devs_pending = dict()
         self.monitored_devs_updated = False
         self.monitored_dev_lock = threading.Lock()
+        # (dev, val) changes of monitored devices, put by the monitor thread
+        # and applied to monitored_devs by the network side
+        self.monitor_queue = queue.SimpleQueue()
 
         ### Object containing information of devices' status ###
         # When used, should guard with status_lock
-        self.status = Status(dev_list, virtual_dev_list)
+        # status_backend: 'dict' (Status) or 'array' (ArrayStatus, slot-indexed)
+        self.status = status_backends[status_backend](dev_list, virtual_dev_list)
         self.status_lock = threading.Lock()
-        # When used should guard with rule_lock and status_lock
-        # rule_scheduled stores rules scheduled to be triggered at a certain time
-        # it is to handle rules with format "if xxx has been true for x time, then..."
-        # If rule has changed, we clear this dictionary
-        # format: {rule id: scheduled time}
-        self.rule_scheduled = dict()
         # mark virtual devices' action as "automated"
         # for example, self.virtual_dev_auto_mark[dev] = (True [[val]], time) means 
         # that the virtual device "dev" has been automatically turned "True" at time
@@ -61,8 +97,42 @@ class MetaInfo(object):
         self.monitored_dev_url = "http://" + self.server_url + "/backend/homeio/get_monitored_devs/"
         self.rule_dev_url = "http://" + self.server_url + "/backend/homeio/get_rules_and_devs/"
         self.update_monitor_url = "http://" + self.server_url + "/backend/homeio/update_monitored_devs/"
+        # timeout of a backend request in seconds
+        self.request_timeout = 10
+
+        ### Polling of rules and devs ###
+        self.rule_poll_interval = 2
+        # if set, ask the backend to hold each poll for up to this many seconds
+        # until something changes (long poll)
+        self.rule_long_poll = None
+        # ETag and fingerprint of the last response, fingerprint of its rules
+        # and the last response itself
+        self.rule_etag = None
+        self.rule_dev_fingerprint = None
+        self.rules_fingerprint = None
+        self.rule_dev_json = None
+        ### Push of monitored devices' status ###
+        # changes within this window (seconds) are coalesced into one push
+        self.status_push_window = 1
+        # sequence number of the last push acknowledged by the backend
+        self.status_push_seq = 0
+        # send all monitored devices instead of the changes (set when the backend asks for it)
+        self.status_push_resync = True
         
-        self.trace = []
+        # trace entries recorded since the start, bounded by trace_capacity
+        # (see TraceStore for the overflow policies)
+        # with journal_dir, entries are journaled to disk and only a hot tail
+        # of trace_capacity entries stays in memory
+        if journal_dir is not None:
+            journal = TraceJournal(journal_dir)
+            trace_capacity = trace_capacity or 4096
+        else:
+            journal = None
+            trace_capacity = trace_capacity or 1000000
+        # {dev: name} given by the backend (see backend_monitor.update_rules_and_devs)
+        self.dev_names = dict()
+        self.trace = TraceStore(dev_list + virtual_dev_list, trace_capacity, trace_overflow, journal,
+                                self.dev_names)
 
         self.get_funcs = {
             'Bit': self.memory_map.Instance.GetBit,
@@ -86,25 +156,54 @@ class MetaInfo(object):
         self.datetime_addr = 65
 
         self.exit_flag = False
+
+        # period of the monitor loop (seconds): the loop runs at tick_period_floor
+        # and doubles its period after idle_tick_threshold ticks without changes,
+        # up to tick_period_ceiling. It returns to the floor on the first change.
+        self.tick_period_floor = 16/1000
+        self.tick_period_ceiling = 128/1000
+        self.idle_tick_threshold = 60
+        # set by monitor()
+        self.scheduler = None
+
         self.dry_run_rounds = 10
 
+        # a tenant (see tenants.py) labels its metrics and names its loggers
+        self.tenant = tenant
+        # tick stage timings, lock waits and counters (see metrics.py),
+        # served by metrics.MetricsServer when started
+        self.metrics = Metrics(labels={'tenant': tenant} if tenant is not None else None)
+        # when a list, trigger_rule appends (time, action device, action value)
+        # of every rule it fires (used by replay)
+        self.action_log = None
+
         # the batch size for uploading
         self.upload_batchsize = 500
+        # upload progress: sequence number of the first trace entry not acknowledged
+        # by the server, and the server's cache token for the upload in progress
+        self.trace_cursor = self.trace.acked_seq
+        self.trace_cache_token = ''
+        # number of entries overwritten before they were uploaded
+        self.trace_skipped = 0
+        # requests session reused across uploads
+        self.trace_client = None
 
         # loggers
         level = logging.INFO
         formatter = logging.Formatter('%(name)s - %(message)s')
         logger_handler = logging.StreamHandler()
         logger_handler.setFormatter(formatter)
-
-        self.logger_rule = logging.getLogger('RULE')
-        self.logger_rule.addHandler(logger_handler)
-        self.logger_rule.setLevel(level)
-
-        self.logger_monitor = logging.getLogger('MONITOR')
-        self.logger_monitor.addHandler(logger_handler)
-        self.logger_monitor.setLevel(level)
-
-        self.logger_trace = logging.getLogger('TRACE')
-        self.logger_trace.addHandler(logger_handler)
-        self.logger_trace.setLevel(level)
+        suffix = '[%s]' % tenant if tenant is not None else ''
+
+        self.logger_rule = logging.getLogger('RULE' + suffix)
+        self.logger_monitor = logging.getLogger('MONITOR' + suffix)
+        self.logger_trace = logging.getLogger('TRACE' + suffix)
+        for logger in (self.logger_rule, self.logger_monitor, self.logger_trace):
+            # loggers are global, only the first MetaInfo of a process adds the handler
+            if not logger.handlers:
+                logger.addHandler(logger_handler)
+            logger.setLevel(level)
+
+    @property
+    def rule_list(self):
+        return list(self.rule_set.rules)
@@ -0,0 +1,234 @@
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# upper bounds of the latency buckets in seconds (10 us .. 1 s)
+LATENCY_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3,
+                   1e-2, 1.6e-2, 2.5e-2, 5e-2, 1e-1, 2.5e-1, 5e-1, 1.0)
+
+# stages of a monitor tick, see monitor.check_value_change
+TICK_STAGES = (
+    'update',             # memory_map.Instance.Update()
+    'read',               # snapshot read and diff (or draining the events)
+    'compare_status',
+    'status',             # status updates (and monitored devices)
+    'trace',              # trace appends
+    'default_controller', # default controllers, motor resets, automation marks
+    'rules',              # _trigger_rule
+    'virtual_devices',
+    'clock_rules',
+    'hold_rules',
+    'flush',              # write buffer flush
+)
+
+
+class Histogram(object):
+    # fixed-bucket histogram, observe() is a bisect and two additions
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        # counts[i] counts values <= buckets[i] (and > buckets[i - 1]), the last one is +Inf
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        # [(upper bound, cumulative count)] as exposed by Prometheus
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+###################################################
+# metrics of the connector
+# the monitor accumulates the time of each tick stage in
+# tick_stages and calls end_tick() once per tick, which
+# feeds the per-stage histograms, so the cost per change
+# is a perf_counter() call and an addition.
+# Counters are plain integers and gauges are read from
+# the objects that own them when scraped.
+# Values are written by the monitor (and the network
+# thread for rule_lock) and read by the metrics server
+# without locking: a scrape may see a tick half counted.
+###################################################
+class Metrics(object):
+    def __init__(self, prefix='homeio_connector', labels=None):
+        self.prefix = prefix
+        # labels added to every sample, e.g., {'tenant': user code} (see tenants.py)
+        self.labels = ','.join('%s="%s"' % (key, _escape(value)) for key, value in (labels or {}).items())
+        self.clock = time.perf_counter
+
+        # {stage: seconds} of the current tick
+        self.tick_stages = dict.fromkeys(TICK_STAGES, 0.0)
+        self.stage_histograms = {stage: Histogram() for stage in TICK_STAGES}
+        self.tick_histogram = Histogram()
+        # {lock name: Histogram} of the time spent waiting for the lock
+        self.lock_wait_histograms = dict()
+
+        # counters
+        self.ticks = 0
+        self.changes = 0
+        self.rule_firings = 0
+        self.rule_installs = 0
+        self.tick_errors = 0
+
+        # [(name, help, type, func)] read when scraped
+        self.collected = []
+
+    def end_tick(self, tick_seconds, changes):
+        self.ticks += 1
+        self.changes += changes
+        self.tick_histogram.observe(tick_seconds)
+        stages = self.tick_stages
+        for stage, seconds in stages.items():
+            if seconds:
+                self.stage_histograms[stage].observe(seconds)
+                stages[stage] = 0.0
+
+    def lock_wait(self, name, seconds):
+        histogram = self.lock_wait_histograms.get(name)
+        if histogram is None:
+            histogram = self.lock_wait_histograms.setdefault(name, Histogram())
+        histogram.observe(seconds)
+
+    def collect(self, name, help_text, func, kind='gauge'):
+        # a value computed when scraped, e.g., a statistic kept by another object
+        # kind: 'gauge' or 'counter' (name should then end with _total)
+        self.collected.append((name, help_text, kind, func))
+
+    ### Prometheus text format ###
+    def _histogram_lines(self, name, histogram, labels=''):
+        labels = ','.join(part for part in (self.labels, labels) if part)
+        sep = ',' if labels else ''
+        lines = []
+        for bound, count in histogram.cumulative():
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append('%s_bucket{%s%sle="%s"} %d' % (name, labels, sep, le, count))
+        suffix = '{%s}' % labels if labels else ''
+        lines.append('%s_sum%s %r' % (name, suffix, histogram.sum))
+        lines.append('%s_count%s %d' % (name, suffix, histogram.count))
+        return lines
+
+    def families(self):
+        # [(name, help, type, sample lines)]
+        p = self.prefix
+        suffix = '{%s}' % self.labels if self.labels else ''
+        families = []
+
+        families.append((p + '_tick_seconds', 'Duration of monitor ticks.', 'histogram',
+                         self._histogram_lines(p + '_tick_seconds', self.tick_histogram)))
+
+        lines = []
+        for stage in TICK_STAGES:
+            lines.extend(self._histogram_lines(p + '_tick_stage_seconds', self.stage_histograms[stage],
+                                               'stage="%s"' % stage))
+        families.append((p + '_tick_stage_seconds', 'Time spent in each stage of a monitor tick.', 'histogram',
+                         lines))
+
+        lines = []
+        for lock_name, histogram in sorted(self.lock_wait_histograms.items()):
+            lines.extend(self._histogram_lines(p + '_lock_wait_seconds', histogram, 'lock="%s"' % lock_name))
+        families.append((p + '_lock_wait_seconds', 'Time spent waiting for a lock.', 'histogram', lines))
+
+        for name, help_text, value in (
+                ('ticks', 'Monitor ticks.', self.ticks),
+                ('changes', 'Device changes found by the monitor.', self.changes),
+                ('rule_firings', 'Rules whose conditions held and whose action was applied.', self.rule_firings),
+                ('rule_installs', 'Rule sets installed.', self.rule_installs),
+                ('tick_errors', 'Monitor ticks that failed with an exception.', self.tick_errors)):
+            name = '%s_%s_total' % (p, name)
+            families.append((name, help_text, 'counter', ['%s%s %d' % (name, suffix, value)]))
+
+        for name, help_text, kind, func in self.collected:
+            try:
+                value = func()
+            except Exception:
+                continue
+            if value is None:
+                continue
+            name = '%s_%s' % (p, name)
+            families.append((name, help_text, kind, ['%s%s %r' % (name, suffix, value)]))
+        return families
+
+    def render(self):
+        return render_families([self])
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_families(metrics_list):
+    # the Prometheus text of several Metrics (e.g., one per tenant, told apart
+    # by their labels), with the HELP and TYPE of each family written once
+    families = dict()
+    for metrics in metrics_list:
+        for name, help_text, kind, lines in metrics.families():
+            if name in families:
+                families[name][2].extend(lines)
+            else:
+                families[name] = (help_text, kind, list(lines))
+    result = []
+    for name, (help_text, kind, lines) in families.items():
+        result.append('# HELP %s %s' % (name, help_text))
+        result.append('# TYPE %s %s' % (name, kind))
+        result.extend(lines)
+    return '\n'.join(result) + '\n'
+
+
+class MetricsGroup(object):
+    # the metrics of several tenants, served as one (see MetricsServer)
+    def __init__(self, members=()):
+        self.members = list(members)
+
+    def render(self):
+        return render_families(self.members)
+
+
+###################################################
+# serve the metrics on a local HTTP endpoint
+# GET /metrics returns the Prometheus text format
+# of a Metrics or a MetricsGroup
+###################################################
+class MetricsServer(object):
+    def __init__(self, metrics: Metrics, host='127.0.0.1', port=9108):
+        self.metrics = metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path.split('?')[0] != '/metrics':
+                    handler.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                handler.send_response(200)
+                handler.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                handler.send_header('Content-Length', str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -1,16 +1,16 @@
-from device import Device
-import time
+from time import perf_counter
 import datetime
-import threading
-import copy
+from operator import attrgetter
 
-from rule import EventExpression
 from meta import MetaInfo
 from actuator import trigger_rule
 from default_controller import trigger_default_controller, calc_virtual_device_status, \
-    check_vdev_change, reset_motors
-from traces import generate_trace_entry
+    check_vdev_change, reset_motors, mark_dependent_virtual_devices
 from dev_monitor import monitor_status_change
+from event_capture import EventCapture
+from scheduler import TickScheduler
+
+_slot_of = attrgetter('slot')
 
 def _to_datetime(datetime_orig, with_sec=False):
     return datetime.datetime(
@@ -21,36 +21,99 @@ def _to_datetime(datetime_orig, with_sec=False):
         minute=datetime_orig.Minute,
         second=datetime_orig.Second if with_sec else 0)
 
-def _trigger_rule(global_meta_info, time_val, dev, val, old_val=None):
-    with global_meta_info.rule_lock:
-        event = EventExpression(dev, '=', val)
-        for rule_id in range(len(global_meta_info.rule_list)):
-            rule = global_meta_info.rule_list[rule_id]
-            if rule.is_hold():
-                if rule.trigger_e.var == dev:
-                    if old_val is None:
-                        should_schedule = rule.trigger_e.check(event)
-                    else:
-                        old_event = EventExpression(dev, '=', old_val)
-                        should_schedule = rule.trigger_e.check(event) and not rule.trigger_e.check(old_event)
-                    if should_schedule:  # should schedule the rule
-                        target_time = time_val + datetime.timedelta(seconds=rule.trigger_e.hold_t)
-                        global_meta_info.rule_scheduled[rule_id] = target_time
-                    else:  # should cancel the scheduled rule
-                        if rule_id in global_meta_info.rule_scheduled:
-                            del global_meta_info.rule_scheduled[rule_id]
-            else:
-                if old_val is None:
-                    if rule.trigger_e.check(event):
-                        trigger_rule(rule, global_meta_info)
-                else:
-                    old_event = EventExpression(dev, '=', old_val)
-                    if rule.trigger_e.check(event) and not rule.trigger_e.check(old_event):
-                        trigger_rule(rule, global_meta_info)
+def _trigger_rule(global_meta_info, rule_set, time_val, dev, val, old_val=None):
+    rule_index = rule_set.index
+    if not rule_index.has_trigger(dev):
+        return
+    # rules with format "if xxx has been true for x time"
+    for rule_id, rule in rule_index.hold.get(dev, ()):
+        if old_val is None:
+            should_schedule = rule.trigger_e.test(val)
+        else:
+            should_schedule = rule.trigger_e.test(val) and not rule.trigger_e.test(old_val)
+        if should_schedule:  # should schedule the rule
+            target_time = time_val + datetime.timedelta(seconds=rule.trigger_e.hold_t)
+            rule_set.timers.schedule(rule_id, target_time)
+        else:  # should cancel the scheduled rule
+            rule_set.timers.cancel(rule_id)
+    # regular rules
+    for rule_id, rule in rule_index.edge.get(dev, ()):
+        if old_val is None:
+            if rule.trigger_e.test(val):
+                trigger_rule(rule, global_meta_info)
+        else:
+            if rule.trigger_e.test(val) and not rule.trigger_e.test(old_val):
+                trigger_rule(rule, global_meta_info)
+
+def _process_device_change(global_meta_info, rule_set, time_val, dev, val):
+    clock = perf_counter
+    t0 = clock()
+    # get the old status
+    old_val = global_meta_info.status.check_status(dev)
+    # value changed, should update status
+    update_id = global_meta_info.status.update_status(dev, val)
+    t1 = clock()
+    # should store trace
+    global_meta_info.trace.record(dev, val, time_val)
+    t2 = clock()
+    # update monitored devices' status
+    monitor_status_change(dev, val, global_meta_info)
+    t3 = clock()
+    # check vdev change (if motor status changed for vdevs, reset automation mark)
+    check_vdev_change(dev, val, global_meta_info)
+    # the virtual devices reading dev are recomputed at the end of the tick
+    mark_dependent_virtual_devices(dev, global_meta_info)
+    # trigger default controllers
+    trigger_default_controller(dev, val, global_meta_info)
+    # need to reset the motors once change finished
+    reset_motors(dev, val, global_meta_info)
+    t4 = clock()
+    # then trigger rules if needed
+    _trigger_rule(global_meta_info, rule_set, time_val, dev, val, old_val)
+
+    stages = global_meta_info.metrics.tick_stages
+    stages['status'] += (t1 - t0) + (t3 - t2)
+    stages['trace'] += t2 - t1
+    stages['default_controller'] += t4 - t3
+    stages['rules'] += clock() - t4
+
+def _process_changes(global_meta_info, rule_set, time_val, changes, missed_capture=None):
+    # handle the [(dev, val)] that differ from the status, returns their number;
+    # missed_capture counts the changes found by a reconciliation poll
+    stages = global_meta_info.metrics.tick_stages
+    clock = perf_counter
+    compare_status = global_meta_info.status.compare_status
+    num_changes = 0
+    for dev, val in changes:
+        t = clock()
+        unchanged = compare_status(dev, val)
+        stages['compare_status'] += clock() - t
+        if not unchanged:
+            if missed_capture is not None:
+                missed_capture.missed += 1
+            _process_device_change(global_meta_info, rule_set, time_val, dev, val)
+            num_changes += 1
+    return num_changes
 
 def check_value_change(global_meta_info: MetaInfo, dry_run=False):
+    # returns the number of device and virtual device changes found by this tick
+    num_changes = 0
+    metrics = global_meta_info.metrics
+    stages = metrics.tick_stages
+    clock = perf_counter
+    tick_start = clock()
+    # the rule set is read once, rule installs swap in a new one for the next tick
+    rule_set = global_meta_info.rule_set
+    if rule_set is not global_meta_info.active_rule_set:
+        # rules changed, pending hold timers of the rules kept are carried over
+        rule_set.adopt_timers(global_meta_info.active_rule_set)
+        global_meta_info.active_rule_set = rule_set
+    wait_start = clock()
     with global_meta_info.memory_map_lock:
+        t = clock()
+        metrics.lock_wait('memory_map_lock', t - wait_start)
         global_meta_info.memory_map.Instance.Update()
+        stages['update'] += clock() - t
 
         # time change
         time_val = global_meta_info.get_funcs['DateTime'](
@@ -64,35 +127,62 @@ def check_value_change(global_meta_info: MetaInfo, dry_run=False):
             # Then trigger rules if needed according to this flag
             time_changed = True
         
+        if not global_meta_info.snapshot.bound:
+            global_meta_info.snapshot.bind(global_meta_info)
+
         # device value changes
+        wait_start = clock()
         with global_meta_info.status_lock:
+            t = clock()
+            metrics.lock_wait('status_lock', t - wait_start)
             # trigger regular rules (without timing)
-            for dev in global_meta_info.dev_list:
-                if dev.datatype == 'DateTime':
-                    continue
-                val = global_meta_info.get_funcs[dev.datatype](
-                    dev.address, global_meta_info.mem_types[dev.typ]).Value
-                if not global_meta_info.status.compare_status(dev, val) and not dry_run:
-                    # get the old status
-                    old_val = global_meta_info.status.check_status(dev)
-                    # value changed, should update status
-                    update_id = global_meta_info.status.update_status(dev, val)
-                    # should store trace
-                    global_meta_info.trace.append(generate_trace_entry(dev, val, time_val))
-                    # update monitored devices' status
-                    monitor_status_change(dev, val, global_meta_info)
-                    # check vdev change (if motor status changed for vdevs, reset automation mark)
-                    check_vdev_change(dev, val, global_meta_info)
-                    # trigger default controllers
-                    trigger_default_controller(dev, val, global_meta_info)
-                    # need to reset the motors once change finished
-                    reset_motors(dev, val, global_meta_info)
-                    # then trigger rules if needed
-                    _trigger_rule(global_meta_info, time_val, dev, val, old_val)
-            # update virtual devices' status
-            for dev in global_meta_info.virtual_dev_list:
-                val = calc_virtual_device_status(dev, global_meta_info.status)
-                if not global_meta_info.status.compare_status(dev, val) and not dry_run:
+            snapshot = global_meta_info.snapshot
+            capture = global_meta_info.event_capture
+            full_poll = False
+            reconciling = False
+            if dry_run:
+                snapshot.read()
+                changes = []
+            elif capture is None:
+                changes = snapshot.changes('Input')
+            elif capture.reconcile_due():
+                # full poll, the pending events are covered by it
+                capture.drain()
+                changes = snapshot.current('Input', global_meta_info.status)
+                full_poll = True
+                reconciling = capture.reconciled > 1
+            else:
+                changes = capture.drain()
+            stages['read'] += clock() - t
+            missed_capture = capture if reconciling else None
+            num_changes += _process_changes(global_meta_info, rule_set, time_val, changes, missed_capture)
+            # outputs are read once the inputs are handled and their writes
+            # applied, so the outputs set by controllers and rules are seen by this tick
+            if not dry_run:
+                t = clock()
+                applied = global_meta_info.write_buffer.apply(global_meta_info)
+                if capture is None:
+                    changes = snapshot.changes('Output')
+                else:
+                    # the events of those writes are raised by the Update() of the flush
+                    changes = applied
+                stages['read'] += clock() - t
+                num_changes += _process_changes(global_meta_info, rule_set, time_val, changes)
+                if full_poll:
+                    t = clock()
+                    changes = snapshot.current('Output', global_meta_info.status)
+                    stages['read'] += clock() - t
+                    num_changes += _process_changes(global_meta_info, rule_set, time_val, changes, missed_capture)
+            # update the status of the virtual devices whose sensor changed
+            t = clock()
+            dirty = global_meta_info.virtual_dev_dirty
+            if dirty and not dry_run:
+                global_meta_info.virtual_dev_dirty = dict()
+            else:
+                dirty = ()
+            for dev in sorted(dirty, key=_slot_of):
+                val = calc_virtual_device_status(dev, global_meta_info)
+                if not global_meta_info.status.compare_status(dev, val):
                     # get the old status
                     old_val = global_meta_info.status.check_status(dev)
                     # value changed, should update status
@@ -104,57 +194,106 @@ def check_value_change(global_meta_info: MetaInfo, dry_run=False):
                         if val == automation_val:
                             is_automated = True
                         del global_meta_info.virtual_dev_auto_mark[dev]
-                    global_meta_info.trace.append(generate_trace_entry(dev, val, time_val, is_automated))
+                    global_meta_info.trace.record(dev, val, time_val, is_automated)
                     # update monitored devices' status
                     monitor_status_change(dev, val, global_meta_info)
                     # then trigger rules if needed
-                    _trigger_rule(global_meta_info, time_val, dev, val, old_val)
-            
+                    _trigger_rule(global_meta_info, rule_set, time_val, dev, val, old_val)
+                    num_changes += 1
+            stages['virtual_devices'] += clock() - t
+
             # trigger clock rules (if it becomes xx:xx)
             if time_changed:
-                with global_meta_info.rule_lock:
-                    if old_time_val is not None and \
-                       time_val > old_time_val and \
-                       time_val-old_time_val < datetime.timedelta(minutes=5):
-                        curr_time = old_time_val.replace(second=0)
-                        while curr_time <= time_val:
-                            if curr_time > old_time_val:
-                                # only trigger once per minute
-                                hour_minute = curr_time.strftime('%H:%M')
-                                time_dev = Device('Memory', 'DateTime', 65, '')
-                                event = EventExpression(time_dev, '=', hour_minute)
-                                for rule in global_meta_info.rule_list:
-                                    if rule.is_clock():
-                                        if rule.trigger_e.check(event):
-                                            trigger_rule(rule, global_meta_info)
-                            curr_time += datetime.timedelta(minutes=1)
+                t = clock()
+                for rule_id, rule in rule_set.index.clock.due(old_time_val, time_val):
+                    trigger_rule(rule, global_meta_info)
+                stages['clock_rules'] += clock() - t
 
             # trigger holding rules (if xxx has been true for xx time)
             if time_changed:
-                with global_meta_info.rule_lock:
-                    to_delete = []
-                    for rule_id in global_meta_info.rule_scheduled:
-                        if time_val >= global_meta_info.rule_scheduled[rule_id]:
-                            rule = global_meta_info.rule_list[rule_id]
-                            trigger_rule(rule, global_meta_info)
-                            to_delete.append(rule_id)
-                    for rule_id in to_delete:
-                        del global_meta_info.rule_scheduled[rule_id]
+                t = clock()
+                for rule_id in rule_set.timers.pop_due(time_val):
+                    trigger_rule(rule_set.by_id[rule_id], global_meta_info)
+                stages['hold_rules'] += clock() - t
+
+        # write the outputs set by this tick, in one go
+        t = clock()
+        global_meta_info.write_buffer.flush(global_meta_info)
+        stages['flush'] += clock() - t
+    metrics.end_tick(clock() - tick_start, num_changes)
+    return num_changes
+
+
+def _start_event_capture(global_meta_info: MetaInfo):
+    capture = EventCapture(global_meta_info)
+    try:
+        with global_meta_info.memory_map_lock:
+            capture.subscribe()
+    except Exception as exc:
+        global_meta_info.logger_monitor.warning('event capture unavailable, polling instead: ' + str(exc))
+        return None
+    global_meta_info.logger_monitor.info('event capture started')
+    return capture
+
+
+def _collect_metrics(global_meta_info: MetaInfo):
+    # statistics kept by the objects of the monitor, read when the metrics are scraped
+    metrics = global_meta_info.metrics
+    scheduler = global_meta_info.scheduler
+    metrics.collect('tick_overruns_total', 'Ticks that started after their deadline.',
+                    lambda: scheduler.overruns, 'counter')
+    metrics.collect('tick_max_lateness_seconds', 'Largest delay of a tick behind its deadline.',
+                    lambda: scheduler.max_lateness)
+    metrics.collect('tick_period_seconds', 'Current period of the monitor loop.',
+                    lambda: scheduler.period)
+    metrics.collect('memory_writes_total', 'Writes to the memory map requested by actions and controllers.',
+                    lambda: global_meta_info.write_buffer.writes, 'counter')
+    metrics.collect('memory_writes_coalesced_total', 'Writes overridden by a later write in the same tick.',
+                    lambda: global_meta_info.write_buffer.coalesced, 'counter')
+    metrics.collect('rule_set_version', 'Version of the installed rule set.',
+                    lambda: global_meta_info.rule_set.version)
+    metrics.collect('rules', 'Number of installed rules.',
+                    lambda: len(global_meta_info.rule_set.rules))
+    metrics.collect('hold_timers', 'Pending hold-rule timers.',
+                    lambda: len(global_meta_info.active_rule_set.timers))
+    metrics.collect('trace_entries', 'Trace entries kept in memory.',
+                    lambda: len(global_meta_info.trace))
+    metrics.collect('trace_dropped_total', 'Trace entries dropped before upload.',
+                    lambda: global_meta_info.trace.dropped, 'counter')
+    metrics.collect('trace_upload_skipped_total', 'Trace entries overwritten before they were uploaded.',
+                    lambda: global_meta_info.trace_skipped, 'counter')
+    metrics.collect('events_missed_total', 'Changes found by reconciliation polls instead of events.',
+                    lambda: global_meta_info.event_capture.missed if global_meta_info.event_capture else None,
+                    'counter')
+
+
+def start_monitor(global_meta_info: MetaInfo):
+    # set up the tick scheduler (and the event capture) of a monitor loop
+    if global_meta_info.capture_mode == 'event':
+        global_meta_info.event_capture = _start_event_capture(global_meta_info)
+    global_meta_info.scheduler = TickScheduler(global_meta_info.tick_period_floor,
+                                               global_meta_info.tick_period_ceiling,
+                                               global_meta_info.idle_tick_threshold)
+    _collect_metrics(global_meta_info)
+
+
+def monitor_tick(global_meta_info: MetaInfo, dry_run=False):
+    num_changes = check_value_change(global_meta_info, dry_run)
+    global_meta_info.trace.flush()
+    global_meta_info.scheduler.tick_done(num_changes)
+
+
+def stop_monitor(global_meta_info: MetaInfo):
+    if global_meta_info.event_capture is not None:
+        with global_meta_info.memory_map_lock:
+            global_meta_info.event_capture.unsubscribe()
 
 
 def monitor(global_meta_info: MetaInfo):
-    # on_input_value_changed = ValueChangeHandler(global_meta_info)
-    # global_meta_info.memory_map.Instance.InputsValueChanged += \
-    #     global_meta_info.memories_changed_event_handler(
-    #         on_input_value_changed)
+    start_monitor(global_meta_info)
     round = 0
     while not global_meta_info.exit_flag:
-        # global_meta_info.memory_map_lock.acquire()
-        # global_meta_info.memory_map.Instance.Update()
-        if round < global_meta_info.dry_run_rounds:
-            check_value_change(global_meta_info, True)
-            round = round + 1
-        else:
-            check_value_change(global_meta_info)
-        # global_meta_info.memory_map_lock.release()
-        time.sleep(16/1000)
+        monitor_tick(global_meta_info, round < global_meta_info.dry_run_rounds)
+        round = round + 1
+        global_meta_info.scheduler.wait()
+    stop_monitor(global_meta_info)
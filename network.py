@@ -0,0 +1,139 @@
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from meta import MetaInfo
+from backend_monitor import fetch_rules_and_devs, update_rules_and_devs, upload_traces, \
+    push_monitored_status
+
+
+###################################################
+# network runtime
+# runs rule polling, monitored-status push and trace
+# upload as coroutines on one event loop (in one thread).
+# The blocking requests calls run in a small thread pool
+# and share one session, i.e., one keep-alive connection
+# pool. Trace uploads run as their own task, so a slow
+# upload never delays a rule refresh.
+# The monitor thread hands monitored-device changes over
+# through meta_info.monitor_queue.
+# One runtime can serve several MetaInfos (one per house,
+# see tenants.py): short rule polls are batched into
+# rounds that poll the houses due at once (every house at
+# its own rule_poll_interval) and then sleep until the next
+# one is due, long polls stay one held request per house.
+# Held long polls and trace uploads run in thread pools
+# of their own (a thread per long-polled house, at most
+# upload_workers uploads and one upload per house), so
+# they never take the threads of the short requests of
+# the other houses.
+###################################################
+class NetworkRuntime(object):
+    def __init__(self, meta_infos, max_workers=4, upload_workers=2):
+        # meta_infos: a MetaInfo or a list of them
+        if isinstance(meta_infos, MetaInfo):
+            meta_infos = [meta_infos]
+        self.meta_infos = list(meta_infos)
+        long_polls = sum(meta_info.rule_long_poll is not None for meta_info in self.meta_infos)
+        self.session = requests.session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers + long_polls + upload_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.long_poll_executor = ThreadPoolExecutor(max_workers=long_polls) if long_polls else None
+        self.upload_executor = ThreadPoolExecutor(max_workers=upload_workers)
+        # {id(meta_info): upload task}
+        self.upload_tasks = dict()
+
+    def run(self):
+        # entry point of the network thread
+        try:
+            asyncio.run(self._main())
+        finally:
+            for executor in (self.executor, self.long_poll_executor, self.upload_executor):
+                if executor is not None:
+                    executor.shutdown(wait=True)
+            self.session.close()
+
+    async def _call(self, func, *args, executor=None):
+        # run a blocking call in a thread pool (the one of the short requests by default)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor or self.executor, functools.partial(func, *args))
+
+    async def _main(self):
+        # uploads share the session as well
+        for meta_info in self.meta_infos:
+            meta_info.trace_client = self.session
+        polled = [meta_info for meta_info in self.meta_infos if meta_info.rule_long_poll is None]
+        long_polled = [meta_info for meta_info in self.meta_infos if meta_info.rule_long_poll is not None]
+        await asyncio.gather(self._poll_rules_batched(polled),
+                             *[self._long_poll_rules(meta_info) for meta_info in long_polled],
+                             *[self._push_status(meta_info) for meta_info in self.meta_infos])
+        if self.upload_tasks:
+            await asyncio.gather(*self.upload_tasks.values())
+
+    async def _poll_rules_once(self, meta_info: MetaInfo):
+        # returns False if the fetch or the update failed, None if nothing changed,
+        # the response otherwise
+        executor = self.executor if meta_info.rule_long_poll is None else self.long_poll_executor
+        try:
+            response_json = await self._call(
+                fetch_rules_and_devs, meta_info, self.session, meta_info.rule_long_poll, executor=executor)
+            if response_json is not None:
+                # a rule that cannot be decoded (e.g., a bad constant) only fails this poll
+                update_rules_and_devs(meta_info, response_json)
+        except Exception as exc:
+            meta_info.logger_rule.warning('rule update failed: ' + str(exc))
+            return False
+
+        # upload trace if needed (at most one upload at a time)
+        last_json = meta_info.rule_dev_json
+        upload_task = self.upload_tasks.get(id(meta_info))
+        if last_json is not None and last_json["loc_token"] == meta_info.loc_token and \
+           last_json["pending_trace"] and (upload_task is None or upload_task.done()):
+            self.upload_tasks[id(meta_info)] = asyncio.ensure_future(
+                self._call(upload_traces, meta_info, executor=self.upload_executor))
+        return response_json
+
+    async def _poll_rules_batched(self, meta_infos):
+        # each round polls the houses that are due concurrently (bounded by the thread pool),
+        # then sleeps until the next house is due; a house is due again rule_poll_interval
+        # after the round that polled it
+        loop = asyncio.get_running_loop()
+        # {id(meta_info): time of its next poll, on the loop clock}
+        due = {id(meta_info): loop.time() for meta_info in meta_infos}
+        while True:
+            meta_infos = [meta_info for meta_info in meta_infos if not meta_info.exit_flag]
+            if not meta_infos:
+                break
+            now = loop.time()
+            polled = [meta_info for meta_info in meta_infos if due[id(meta_info)] <= now]
+            await asyncio.gather(*[self._poll_rules_once(meta_info) for meta_info in polled])
+            now = loop.time()
+            for meta_info in polled:
+                due[id(meta_info)] = now + meta_info.rule_poll_interval
+            await asyncio.sleep(max(min(due[id(meta_info)] for meta_info in meta_infos) - now, 0))
+
+    async def _long_poll_rules(self, meta_info: MetaInfo):
+        while not meta_info.exit_flag:
+            started = time.monotonic()
+            response_json = await self._poll_rules_once(meta_info)
+            if response_json is False:
+                await asyncio.sleep(meta_info.rule_poll_interval)
+                continue
+            # see rule_dev_monitor
+            elapsed = time.monotonic() - started
+            if response_json is None and elapsed < meta_info.rule_poll_interval:
+                await asyncio.sleep(meta_info.rule_poll_interval - elapsed)
+
+    async def _push_status(self, meta_info: MetaInfo):
+        while not meta_info.exit_flag:
+            try:
+                await self._call(push_monitored_status, meta_info, self.session)
+            except Exception as exc:
+                meta_info.logger_monitor.warning('device status push failed: ' + str(exc))
+            await asyncio.sleep(meta_info.status_push_window)
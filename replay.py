@@ -0,0 +1,174 @@
+import argparse
+import datetime
+import json
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from device import Device, init_dev_list
+from meta import MetaInfo
+from monitor import check_value_change
+from memory_backend import load_memory_backend
+from rule_decoder import json_to_rule_list, json_to_dev_names
+from backend_monitor import install_rules
+from traces import generate_trace_entry
+
+TIMESTAMP_FORMAT = '%H:%M:%S %m/%d/%Y'
+
+
+###################################################
+# offline replay of a recorded trace
+# the input entries of a trace (generate_trace_entry
+# format) are fed into the simulated memory map and
+# each distinct timestamp is run as one monitor tick
+# (check_value_change), so rules, hold timers, clock
+# rules and default controllers behave as they do live.
+# Between two timestamps, extra ticks are run when a hold
+# timer or a clock rule is due, instead of waiting in
+# real time. The first timestamp sets up the initial
+# state of the house, rules are installed after it.
+# Outputs and virtual devices are not fed: they are what
+# the replayed rules and controllers produce.
+###################################################
+def parse_trace(entries):
+    # [(time, [(dev, val)])] of the input entries, grouped by timestamp in order
+    groups = []
+    last_time = None
+    for entry in entries:
+        if entry['dev_typ'] != 'Input':
+            continue
+        if entry['timestamp'] is not None:
+            last_time = datetime.datetime.strptime(entry['timestamp'], TIMESTAMP_FORMAT)
+        if last_time is None:
+            continue
+        dev = Device(entry['dev_typ'], entry['dev_datatype'], entry['dev_address'], entry['dev_name'])
+        if groups and groups[-1][0] == last_time:
+            groups[-1][1].append((dev, entry['val']))
+        else:
+            groups.append((last_time, [(dev, entry['val'])]))
+    return groups
+
+
+def _next_wakeup(meta_info: MetaInfo, now):
+    # the next time a hold timer or a clock rule is due after now
+    # rules installed since the last tick are only adopted by the next one: their
+    # clock rules count already, pending hold timers are still in the active set
+    wakeups = [meta_info.active_rule_set.timers.next_target(),
+               meta_info.rule_set.index.clock.next_due(now)]
+    wakeups = [wakeup for wakeup in wakeups if wakeup is not None and wakeup > now]
+    return min(wakeups) if wakeups else None
+
+
+class Replay(object):
+    def __init__(self, rule_list, topology=None, status_backend='array'):
+        memory_map, memory_type, handler = load_memory_backend('sim')
+        dev_list, virtual_dev_list = init_dev_list(topology)
+        self.meta_info = MetaInfo(memory_map, memory_type, handler, dev_list, virtual_dev_list, [],
+                                  'replay', 'localhost', status_backend=status_backend,
+                                  trace_capacity=4096, trace_overflow='grow', topology=topology)
+        for logger in (self.meta_info.logger_rule, self.meta_info.logger_monitor, self.meta_info.logger_trace):
+            logger.setLevel(logging.WARNING)
+        self.meta_info.action_log = []
+        self.instance = memory_map.Instance
+        self.rule_list = rule_list
+        self.ticks = 0
+
+    def _tick(self, now):
+        self.instance.now = now
+        check_value_change(self.meta_info)
+        self.instance.writes = []
+        self.ticks += 1
+
+    def run(self, groups):
+        # replay [(time, [(dev, val)])] (see parse_trace), returns the actions
+        # of the fired rules as trace entries
+        instance = self.instance
+        for i, (time_val, changes) in enumerate(groups):
+            if i > 0:
+                wakeup = _next_wakeup(self.meta_info, instance.now)
+                while wakeup is not None and wakeup < time_val:
+                    self._tick(wakeup)
+                    wakeup = _next_wakeup(self.meta_info, instance.now)
+            for dev, val in changes:
+                instance.set_input(dev.typ, dev.datatype, dev.address, val)
+            self._tick(time_val)
+            if i == 0:
+                install_rules(self.meta_info, self.rule_list)
+        dev_names = self.meta_info.dev_names
+        return [generate_trace_entry(dev, val, time_val, True, dev_names.get(dev, ''))
+                for time_val, dev, val in self.meta_info.action_log]
+
+
+def replay(entries, rules, topology=None):
+    """
+
+    :param entries: trace entries in the generate_trace_entry format
+    :param rules: a list of TAPRules or rules in the backend format ({'rules': [...]})
+    :return: a report with the actions of the fired rules
+    """
+    rule_list = json_to_rule_list(rules) if isinstance(rules, dict) else rules
+    start = time.perf_counter()
+    engine = Replay(rule_list, topology)
+    if isinstance(rules, dict):
+        engine.meta_info.dev_names.update(json_to_dev_names(rules))
+    actions = engine.run(parse_trace(entries))
+    return {
+        'actions': actions,
+        'ticks': engine.ticks,
+        'rule_firings': engine.meta_info.metrics.rule_firings,
+        'seconds': time.perf_counter() - start,
+    }
+
+
+### replay of many rule sets in a process pool ###
+_worker_entries = None
+
+
+def _init_worker(entries):
+    # the trace is sent once per worker process instead of once per rule set
+    global _worker_entries
+    _worker_entries = entries
+
+
+def _replay_in_worker(rules):
+    return replay(_worker_entries, rules)
+
+
+def replay_many(entries, candidates, processes=None):
+    # replay every candidate rule set against the same trace,
+    # returns the reports in the order of candidates
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(entries,)) as executor:
+        return list(executor.map(_replay_in_worker, candidates))
+
+
+def _load_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='replay a trace against candidate rule sets')
+    parser.add_argument('trace', help="JSON trace: a list of entries, or {'trace': [...]}")
+    parser.add_argument('rules', nargs='+', help="JSON rule sets in the backend format ({'rules': [...]})")
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--output', default=None, help='write the reports to this file instead of stdout')
+    args = parser.parse_args()
+
+    entries = _load_json(args.trace)
+    if isinstance(entries, dict):
+        entries = entries['trace']
+    candidates = [_load_json(path) for path in args.rules]
+    if len(candidates) == 1:
+        reports = [replay(entries, candidates[0])]
+    else:
+        reports = replay_many(entries, candidates, args.processes)
+    result = [dict(report, rules=path) for path, report in zip(args.rules, reports)]
+    if args.output is None:
+        print(json.dumps(result, indent=2))
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,47 @@
 from typing import List, Dict, Any, Tuple
+import datetime
+import functools
+import operator
 
 from device import Device
+from timers import TimerQueue
+
+
+def _to_bool(val):
+    # the backend may send boolean constants as strings, and bool("False") is True
+    if isinstance(val, str):
+        return val.strip().lower() in ('true', '1')
+    return bool(val)
+
+
+# convert a constant from the backend to the datatype of its device
+const_converters = {
+    'Bit': _to_bool,
+    'Byte': int,
+    'Short': int,
+    'Int': int,
+    'Long': int,
+    'Float': float,
+    'Double': float,
+    'String': str,
+    'DateTime': str,
+}
+
+# comparators with their operands swapped, so that "val <comp> const" can be
+# bound as functools.partial(func, const) and evaluated in a single call
+swapped_comp_funcs = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.gt,
+    '>': operator.lt,
+    '<=': operator.ge,
+    '>=': operator.le,
+}
 
 class Expression(object):
+    # the name the backend gives to var (set by the rule decoder), var.name otherwise
+    name = None
+
     def __init__(self, var: Device, comp: str, val):
         """
 
@@ -14,29 +53,26 @@ class Expression(object):
         self.comp = comp
         self.val = val
 
+    def compile(self):
+        # convert the constant once and bind the comparator, so that
+        # self.test(val) is equivalent to "val <comp> const"
+        # unknown comparators are treated as '>=' (as the old if/elif chain did)
+        convert = const_converters.get(self.var.datatype)
+        self.const = convert(self.val) if convert is not None else self.val
+        self.test = functools.partial(swapped_comp_funcs.get(self.comp, operator.le), self.const)
+
     def _simpleCheck(self, var: Device, val):
-        if var == self.var:
-            self_val = type(val)(self.val)
-            if self.comp == '=':
-                return val == self_val
-            elif self.comp == '!=':
-                return val != self_val
-            elif self.comp == '<':
-                return val < self_val
-            elif self.comp == '>':
-                return val > self_val
-            elif self.comp == '<=':
-                return val <= self_val
-            else:  # self.comp == '>=
-                return val >= self_val
-        else:
-            return False
+        return var == self.var and self.test(val)
+
+    def key(self):
+        # content of the expression, see TAPRule.key()
+        return self.var, self.comp, getattr(self, 'const', self.val)
     
     def __eq__(self, o: object) -> bool:
         return self.var == o.var and self.comp == o.comp and self.val == o.val
     
     def __str__(self) -> str:
-        return str(self.var.name) + self.comp + str(self.val)
+        return str(self.var.name if self.name is None else self.name) + self.comp + str(self.val)
 
 
 class ActionExpression(Expression):
@@ -62,6 +98,7 @@ class ConditionExpression(Expression):
         :param val:
         """
         super(ConditionExpression, self).__init__(var, comp, val)
+        self.compile()
 
     def check(self, var: Device, val):
         return self._simpleCheck(var, val)
@@ -85,6 +122,7 @@ class TriggerExpression(Expression):
             raise Exception("a trigger cannot be both types of timing expression")
         self.hold_t = hold_t
         self.delay = delay
+        self.compile()
 
 
     def check(self, event):
@@ -105,6 +143,9 @@ class TriggerExpression(Expression):
     def __eq__(self, o: object) -> bool:
         return super().__eq__(o) and self.hold_t == o.hold_t and self.delay == o.delay
 
+    def key(self):
+        return super().key() + (self.hold_t, self.delay)
+
     def __str__(self):
         return 'hold: %s, delay: %s, %s%s%s' % (self.hold_t, self.delay, self.var, self.comp, self.val)
 
@@ -137,6 +178,11 @@ class TAPRule(object):
     def is_hold(self):
         return self.trigger_e.hold_t is not None
 
+    def key(self):
+        # a hashable form of the rule content, the same for equal rules
+        # no matter where they are in the rule list
+        return self.trigger_e.key(), tuple(cond.key() for cond in self.condition), self.action.key()
+
     def __eq__(self, o: object) -> bool:
         return self.trigger_e == o.trigger_e and self.condition == o.condition and self.action == o.action
     
@@ -149,3 +195,157 @@ class TAPRule(object):
 
     def __repr__(self) -> str:
         return str(self)
+
+
+MINUTES_PER_DAY = 24 * 60
+_MINUTE = datetime.timedelta(minutes=1)
+
+
+def _minute_of_day(hour_minute):
+    # 'HH:MM' -> minute of day, None if it is not in that exact form
+    try:
+        hour, minute = (int(part) for part in hour_minute.split(':'))
+    except (AttributeError, ValueError):
+        return None
+    if 0 <= hour < 24 and 0 <= minute < 60 and '%02d:%02d' % (hour, minute) == hour_minute:
+        return hour * 60 + minute
+    return None
+
+
+class ClockIndex(object):
+    # clock rules ("if it becomes xx:xx") by minute of day
+    # minutes: {minute of day: [(rule id, rule)]} for "=" triggers
+    # other:   [(rule id, rule)] for other comparators, tested against 'HH:MM'
+    def __init__(self):
+        self.minutes = dict()
+        self.other = []
+
+    def add(self, rule_id, rule):
+        trigger_e = rule.trigger_e
+        minute = _minute_of_day(trigger_e.const) if trigger_e.comp == '=' else None
+        if minute is None:
+            self.other.append((rule_id, rule))
+        else:
+            self.minutes.setdefault(minute, []).append((rule_id, rule))
+
+    def __len__(self):
+        return sum(len(rules) for rules in self.minutes.values()) + len(self.other)
+
+    def __iter__(self):
+        for minute in sorted(self.minutes):
+            yield from self.minutes[minute]
+        yield from self.other
+
+    def next_due(self, after: datetime.datetime):
+        # the first minute boundary later than after at which a rule may fire,
+        # None if there are no clock rules
+        if not self.minutes and not self.other:
+            return None
+        first = after.replace(second=0, microsecond=0) + _MINUTE
+        if self.other:
+            return first
+        start = first.hour * 60 + first.minute
+        delta = min((minute - start) % MINUTES_PER_DAY for minute in self.minutes)
+        return first + delta * _MINUTE
+
+    def due(self, old_time: datetime.datetime, new_time: datetime.datetime):
+        # the rules whose minute was crossed when the clock moved from old_time
+        # to new_time, i.e., a minute boundary m with old_time < m <= new_time,
+        # in the order the minutes were crossed; every rule is returned at most
+        # once, no matter how long the jump is
+        # the clock standing still or going back (e.g., a restarted scene)
+        # crosses nothing
+        if old_time is None or new_time <= old_time:
+            return []
+        first = old_time.replace(second=0, microsecond=0) + _MINUTE
+        last = new_time.replace(second=0, microsecond=0)
+        if last < first:
+            return []
+        # a day or more covers every minute of the day once, from first on
+        crossed = min((last - first) // _MINUTE + 1, MINUTES_PER_DAY)
+        start = first.hour * 60 + first.minute
+
+        due = []
+        minutes = self.minutes
+        if len(minutes) < crossed:
+            # fewer buckets than crossed minutes, order the buckets instead
+            for minute in sorted(minutes, key=lambda m: (m - start) % MINUTES_PER_DAY):
+                if (minute - start) % MINUTES_PER_DAY < crossed:
+                    due.extend(minutes[minute])
+        else:
+            for i in range(crossed):
+                rules = minutes.get((start + i) % MINUTES_PER_DAY)
+                if rules:
+                    due.extend(rules)
+        if self.other:
+            fired = set()
+            for i in range(crossed):
+                minute = (start + i) % MINUTES_PER_DAY
+                hour_minute = '%02d:%02d' % divmod(minute, 60)
+                for rule_id, rule in self.other:
+                    if rule_id not in fired and rule.trigger_e.test(hour_minute):
+                        fired.add(rule_id)
+                        due.append((rule_id, rule))
+        return due
+
+
+class RuleIndex(object):
+    # index the installed rules by their trigger device, so that a value
+    # change only touches the rules that can actually fire
+    # edge:  {dev: [(rule id, rule)]} for regular rules
+    # hold:  {dev: [(rule id, rule)]} for "if xxx has been true for x time"
+    # clock: ClockIndex of "if it becomes xx:xx"
+    # rule id is the position of the rule in the rule list unless rule_ids is given
+    def __init__(self, rule_list: List[TAPRule], rule_ids=None):
+        self.edge = dict()
+        self.hold = dict()
+        self.clock = ClockIndex()
+        if rule_ids is None:
+            rule_ids = range(len(rule_list))
+        for rule_id, rule in zip(rule_ids, rule_list):
+            if rule.is_hold():
+                self.hold.setdefault(rule.trigger_e.var, []).append((rule_id, rule))
+            elif rule.is_clock():
+                self.clock.add(rule_id, rule)
+            else:
+                self.edge.setdefault(rule.trigger_e.var, []).append((rule_id, rule))
+
+    def has_trigger(self, dev: Device) -> bool:
+        return dev in self.edge or dev in self.hold
+
+
+def stable_rule_ids(rule_list: List[TAPRule]):
+    # rule ids that survive rule updates: (rule content, n) for the n-th
+    # rule with that content, so a rule keeps its id when other rules are
+    # added, removed or reordered
+    seen = dict()
+    rule_ids = []
+    for rule in rule_list:
+        key = rule.key()
+        n = seen.get(key, 0)
+        seen[key] = n + 1
+        rule_ids.append((key, n))
+    return rule_ids
+
+
+class RuleSet(object):
+    # an installed rule list together with everything derived from it
+    # the rules and the index are never modified after the rule set is built;
+    # installing rules builds a new RuleSet and swaps meta_info.rule_set by
+    # reference, so the monitor reads one reference per tick without locking
+    # timers is the schedule state of hold rules, only touched by the monitor thread
+    def __init__(self, rule_list: List[TAPRule], version=0):
+        self.version = version
+        self.rules = tuple(rule_list)
+        self.rule_ids = stable_rule_ids(self.rules)
+        # {rule id: rule}
+        self.by_id = dict(zip(self.rule_ids, self.rules))
+        self.index = RuleIndex(self.rules, self.rule_ids)
+        # rules with format "if xxx has been true for x time" waiting for their time
+        # keyed by rule id, see TimerQueue
+        self.timers = TimerQueue()
+
+    def adopt_timers(self, previous):
+        # carry the pending hold timers of the previous rule set over to this one,
+        # the timers of rules that are gone are dropped
+        self.timers.adopt(previous.timers, self.by_id)
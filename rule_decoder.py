@@ -0,0 +1,116 @@
+import json
+import threading
+from collections import OrderedDict
+
+from device import Device
+from rule import TAPRule, TriggerExpression, ConditionExpression, ActionExpression
+
+typ_map = {
+    'o': 'Output',
+    'i': 'Input',
+    'm': 'Memory'
+}
+
+datatype_map = {
+    'b': 'Bit',
+    'f': 'Float',
+    'dt': 'DateTime'
+}
+
+
+# Translate a backend dev to its (canonical) Device
+def json_to_dev(dev_json):
+    return Device(
+        typ_map[dev_json['typ']],
+        datatype_map[dev_json['data_typ']],
+        int(dev_json['address']),
+        dev_json['name']
+    )
+
+
+# Translate one json rule from backend to a TAPRule
+def json_to_rule(rule_json):
+    trigger_json = rule_json['trigger']
+    trigger = TriggerExpression(json_to_dev(trigger_json['dev']), trigger_json['comp'], trigger_json['val'],
+                                hold_t=trigger_json['hold_t'])
+    trigger.name = trigger_json['dev']['name']
+    conditions = []
+    for cond in rule_json['conditions']:
+        condition = ConditionExpression(json_to_dev(cond['dev']), cond['comp'], cond['val'])
+        condition.name = cond['dev']['name']
+        conditions.append(condition)
+    action_json = rule_json['action']
+    action = ActionExpression(json_to_dev(action_json['dev']), action_json['comp'], action_json['val'])
+    action.name = action_json['dev']['name']
+    return TAPRule(trigger, conditions, action)
+
+
+###################################################
+# decode rules from backend with a LRU cache
+# the key of a rule is its canonical JSON text, so a
+# rule that comes back unchanged in the next poll costs
+# one encode and one lookup, and is the same TAPRule
+# object as before (rules are not modified once built).
+# Shared by the network thread and the legacy monitors,
+# hence the lock.
+###################################################
+class RuleDecoder(object):
+    def __init__(self, maxsize=16384):
+        self.maxsize = maxsize
+        # {rule JSON text: TAPRule}, least recently used first
+        self.cache = OrderedDict()
+        self.encode = json.JSONEncoder(sort_keys=True, separators=(',', ':')).encode
+        self.lock = threading.Lock()
+
+        # statistics
+        self.hits = 0
+        self.misses = 0
+
+    def _decode(self, key, rule_json):
+        # called with the lock held
+        cache = self.cache
+        rule = cache.get(key)
+        if rule is not None:
+            cache.move_to_end(key)
+            self.hits += 1
+            return rule
+        rule = json_to_rule(rule_json)
+        self.misses += 1
+        cache[key] = rule
+        if len(cache) > self.maxsize:
+            cache.popitem(last=False)
+        return rule
+
+    def decode(self, rule_json):
+        key = self.encode(rule_json)
+        with self.lock:
+            return self._decode(key, rule_json)
+
+    def decode_list(self, response_json):
+        encode = self.encode
+        keyed = [(encode(rule_json), rule_json) for rule_json in response_json['rules']]
+        with self.lock:
+            return [self._decode(key, rule_json) for key, rule_json in keyed]
+
+
+decoder = RuleDecoder()
+
+
+# Translate json rules from backend to TAPRules
+def json_to_rule_list(response_json):
+    return decoder.decode_list(response_json)
+
+
+# Translate backend devs to Devices
+def json_to_dev_set(response_json):
+    return set(json_to_dev(dev_json) for dev_json in response_json['devs'])
+
+
+# {Device: name} of the backend devs and of the devices used by the rules
+def json_to_dev_names(response_json):
+    dev_jsons = list(response_json.get('devs', ()))
+    for rule_json in response_json['rules']:
+        dev_jsons.append(rule_json['trigger']['dev'])
+        dev_jsons.extend(cond['dev'] for cond in rule_json['conditions'])
+        dev_jsons.append(rule_json['action']['dev'])
+    return {json_to_dev(dev_json): dev_json['name'] for dev_json in dev_jsons}
@@ -0,0 +1,72 @@
+import time
+
+
+###################################################
+# schedule the ticks of the monitor loop
+# ticks run on absolute deadlines (so processing time
+# does not add up to the period), and the period steps
+# down after idle_threshold quiet ticks until it reaches
+# the ceiling. The first change resets it to the floor.
+###################################################
+class TickScheduler(object):
+    def __init__(self, period_floor, period_ceiling, idle_threshold,
+                 clock=time.monotonic, sleep=time.sleep):
+        """
+
+        :param period_floor: the shortest period (full poll rate) in seconds
+        :param period_ceiling: the longest period when idle in seconds
+        :param idle_threshold: number of quiet ticks before the period is doubled
+        """
+        self.period_floor = period_floor
+        self.period_ceiling = max(period_ceiling, period_floor)
+        self.idle_threshold = idle_threshold
+        self.clock = clock
+        self.sleep = sleep
+
+        self.period = period_floor
+        self.deadline = None
+        self.quiet_ticks = 0
+
+        # statistics
+        self.ticks = 0
+        self.overruns = 0
+        self.max_lateness = 0.0
+
+    def tick_done(self, changes):
+        # adapt the period to the number of changes found by the last tick
+        self.ticks += 1
+        if changes:
+            self.quiet_ticks = 0
+            self.period = self.period_floor
+        else:
+            self.quiet_ticks += 1
+            if self.quiet_ticks >= self.idle_threshold and self.period < self.period_ceiling:
+                self.quiet_ticks = 0
+                self.period = min(self.period * 2, self.period_ceiling)
+
+    def next_deadline(self):
+        # the deadline (on self.clock) of the next tick
+        # if it has already passed, it is an overrun and the schedule
+        # is re-anchored at now instead of running the missed ticks back to back
+        now = self.clock()
+        if self.deadline is None:
+            self.deadline = now
+        self.deadline += self.period
+        if now >= self.deadline:
+            self.overruns += 1
+            self.max_lateness = max(self.max_lateness, now - self.deadline)
+            self.deadline = now
+        return self.deadline
+
+    def wait(self):
+        # sleep until the next deadline
+        delay = self.next_deadline() - self.clock()
+        if delay > 0:
+            self.sleep(delay)
+
+    def late_start(self, lateness):
+        # the tick started lateness seconds after its deadline (e.g., all the
+        # workers of a shared pool were busy), a period or more counts as an overrun
+        self.max_lateness = max(self.max_lateness, lateness)
+        if lateness >= self.period:
+            self.overruns += 1
@@ -0,0 +1,247 @@
+import datetime
+import heapq
+import json
+import time
+
+
+###################################################
+# in-process simulation of the Home I/O memory map
+# (EngineIO) for running the connector without
+# Home I/O, e.g., for tests and benchmarks on Linux.
+# It has the surface the connector uses:
+#   SimMemoryMap.Instance.GetBit/GetFloat/.../GetDateTime(address, mem_type).Value
+#   SimMemoryMap.Instance.Update()
+#   SimMemoryMap.Instance.InputsValueChanged/OutputsValueChanged += handler
+# Inputs are changed by a script (or set_input) and become
+# visible on the next Update(), writes of the connector are
+# recorded in Instance.writes. The clock (DateTime memory 65)
+# is advanced by hand or runs time_scale times faster than
+# the wall clock.
+###################################################
+class SimMemoryType(object):
+    Input = 'Input'
+    Output = 'Output'
+    Memory = 'Memory'
+
+
+class SimDateTime(object):
+    # the attributes of System.DateTime read by the connector
+    def __init__(self, dt: datetime.datetime):
+        self.Year = dt.year
+        self.Month = dt.month
+        self.Day = dt.day
+        self.Hour = dt.hour
+        self.Minute = dt.minute
+        self.Second = dt.second
+        self.Millisecond = dt.microsecond // 1000
+
+    def __str__(self):
+        return '%02d:%02d:%02d %02d/%02d/%04d' % (
+            self.Hour, self.Minute, self.Second, self.Month, self.Day, self.Year)
+
+
+def _spin(us):
+    # emulate the cost of crossing the CLR boundary
+    end = time.perf_counter() + us / 1e6
+    while time.perf_counter() < end:
+        pass
+
+
+class SimMemory(object):
+    def __init__(self, instance, mem_type, datatype, address, value):
+        self._instance = instance
+        self._value = value
+        # the value as of the last Update()
+        self._synced = value
+        self.MemoryType = mem_type
+        self.DataType = datatype
+        self.Address = address
+
+    @property
+    def Value(self):
+        if self._instance.crossing_us:
+            _spin(self._instance.crossing_us)
+        return self._value
+
+    @Value.setter
+    def Value(self, value):
+        instance = self._instance
+        if instance.crossing_us:
+            _spin(instance.crossing_us)
+        instance.writes.append((instance.now, self.MemoryType, self.DataType, self.Address, value))
+        self._value = value
+        instance.dirty[self] = None
+
+
+class SimClockMemory(object):
+    # DateTime memory of the simulated clock
+    def __init__(self, instance):
+        self._instance = instance
+        self.MemoryType = SimMemoryType.Memory
+        self.DataType = 'DateTime'
+        self.Address = instance.datetime_addr
+
+    @property
+    def Value(self):
+        return SimDateTime(self._instance.now)
+
+
+class SimEvent(object):
+    # a .NET event: handlers are attached with += and detached with -=
+    def __init__(self):
+        self.handlers = []
+
+    def __iadd__(self, handler):
+        self.handlers.append(handler)
+        return self
+
+    def __isub__(self, handler):
+        self.handlers.remove(handler)
+        return self
+
+    def fire(self, sender, args):
+        for handler in list(self.handlers):
+            handler(sender, args)
+
+
+class SimMemoriesChangedEventArgs(object):
+    def __init__(self, memories):
+        self.MemoriesBit = [memory for memory in memories if memory.DataType == 'Bit']
+        self.MemoriesFloat = [memory for memory in memories if memory.DataType == 'Float']
+        self.MemoriesOther = [memory for memory in memories if memory.DataType not in ('Bit', 'Float')]
+
+
+class SimMemoriesChangedEventHandler(object):
+    # the delegate type of InputsValueChanged/OutputsValueChanged
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, sender, args):
+        self.func(sender, args)
+
+
+_defaults = {
+    'Bit': False,
+    'Byte': 0,
+    'Short': 0,
+    'Int': 0,
+    'Long': 0,
+    'Float': 0.0,
+    'Double': 0.0,
+    'String': '',
+    'TimeSpan': 0.0,
+}
+
+
+class SimInstance(object):
+    def __init__(self, start=None, time_scale=None, crossing_us=0.0):
+        """
+
+        :param start: the simulated time at start (datetime)
+        :param time_scale: if given, the clock runs time_scale times faster than
+                           the wall clock, otherwise it only moves with advance()
+        :param crossing_us: simulated cost of one call into the memory map in microseconds
+        """
+        self.now = start if start is not None else datetime.datetime(2021, 1, 1, 8, 0, 0)
+        self.time_scale = time_scale
+        self.crossing_us = crossing_us
+        self.datetime_addr = 65
+        self._wall = time.monotonic()
+
+        # {(mem_type, datatype, address): SimMemory}
+        self.memories = dict()
+        # memories written since the last Update(), in the order of the writes
+        self.dirty = dict()
+        # {memory: value} set by set_input, applied by the next Update()
+        self.pending = dict()
+        # heap of (time, n, (mem_type, datatype, address, value)) of inputs to change,
+        # see schedule()
+        self.script = []
+        self._steps = 0
+        # [(time, mem_type, datatype, address, value)] of the writes to memories
+        self.writes = []
+        self.updates = 0
+
+        self.InputsValueChanged = SimEvent()
+        self.OutputsValueChanged = SimEvent()
+        self._clock = SimClockMemory(self)
+
+        for datatype in _defaults:
+            setattr(self, 'Get' + datatype, self._getter(datatype))
+
+    def _getter(self, datatype):
+        default = _defaults[datatype]
+
+        def get(address, mem_type):
+            if self.crossing_us:
+                _spin(self.crossing_us)
+            key = (mem_type, datatype, address)
+            memory = self.memories.get(key)
+            if memory is None:
+                memory = SimMemory(self, mem_type, datatype, address, default)
+                self.memories[key] = memory
+            return memory
+        return get
+
+    def GetDateTime(self, address, mem_type):
+        return self._clock
+
+    ### simulation ###
+    def advance(self, seconds):
+        self.now += datetime.timedelta(seconds=seconds)
+
+    def set_input(self, mem_type, datatype, address, value):
+        # change a memory as the simulated house would, visible from the next Update()
+        memory = self._getter(datatype)(address, mem_type)
+        self.pending[memory] = value
+
+    def schedule(self, at, mem_type, datatype, address, value):
+        # change a memory once the simulated time reaches at
+        # (a datetime, or seconds from now)
+        if not isinstance(at, datetime.datetime):
+            at = self.now + datetime.timedelta(seconds=at)
+        heapq.heappush(self.script, (at, self._steps, (mem_type, datatype, address, value)))
+        self._steps += 1
+
+    def load_script(self, path):
+        # a JSON list of {"at": seconds from now, "typ": "Input", "datatype": "Bit",
+        # "address": 0, "value": true}
+        with open(path) as f:
+            for step in json.load(f):
+                self.schedule(step['at'], step.get('typ', SimMemoryType.Input), step['datatype'],
+                              step['address'], step['value'])
+
+    def Update(self):
+        self.updates += 1
+        if self.time_scale is not None:
+            wall = time.monotonic()
+            self.now += datetime.timedelta(seconds=(wall - self._wall) * self.time_scale)
+            self._wall = wall
+        while self.script and self.script[0][0] <= self.now:
+            _, _, step = heapq.heappop(self.script)
+            self.set_input(*step)
+        if self.pending:
+            for memory, value in self.pending.items():
+                memory._value = value
+                self.dirty[memory] = None
+            self.pending = dict()
+
+        # raise the events for the memories changed since the last Update()
+        if not self.dirty:
+            return
+        changed = [memory for memory in self.dirty if memory._value != memory._synced]
+        self.dirty = dict()
+        for memory in changed:
+            memory._synced = memory._value
+        inputs = [memory for memory in changed if memory.MemoryType == SimMemoryType.Input]
+        outputs = [memory for memory in changed if memory.MemoryType != SimMemoryType.Input]
+        if inputs:
+            self.InputsValueChanged.fire(self, SimMemoriesChangedEventArgs(inputs))
+        if outputs:
+            self.OutputsValueChanged.fire(self, SimMemoriesChangedEventArgs(outputs))
+
+
+class SimMemoryMap(object):
+    # like EngineIO.MemoryMap, the memory map is reached through .Instance
+    def __init__(self, instance=None):
+        self.Instance = instance if instance is not None else SimInstance()
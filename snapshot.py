@@ -0,0 +1,153 @@
+from typing import List
+from array import array
+from operator import attrgetter
+import math
+
+from device import Device
+from status import KIND_BIT, KIND_FLOAT, QUANT_UNKNOWN, quantize, ArrayStatus
+
+_get_value = attrgetter('Value')
+
+
+def _slot_range(slots):
+    if None in slots:
+        return None
+    if slots and slots == list(range(slots[0], slots[0] + len(slots))):
+        return range(slots[0], slots[0] + len(slots))
+    return slots
+
+
+class SnapshotBlock(object):
+    # devices sharing a memory type and a datatype, read into one contiguous buffer
+    def __init__(self, typ, datatype, devs: List[Device]):
+        self.typ = typ
+        self.datatype = datatype
+        self.kind = KIND_BIT if datatype == 'Bit' else KIND_FLOAT
+        self.devs = devs
+        self.addresses = [dev.address for dev in devs]
+        # status slots of the devices, a range when they are contiguous (see ArrayStatus.diff)
+        self.slots = _slot_range([dev.slot for dev in devs])
+        # memory objects of the devices, resolved once by bind()
+        self.handles = None
+        # raw values of the last read (NaN means "never read")
+        self.buffer = array('d', [math.nan] * len(devs))
+        # quantized values that have been reported as changes
+        self.quant = array('q', [QUANT_UNKNOWN] * len(devs))
+
+    def bind(self, meta_info):
+        get_func = meta_info.get_funcs[self.datatype]
+        mem_type = meta_info.mem_types[self.typ]
+        self.handles = [get_func(address, mem_type) for address in self.addresses]
+
+    def read(self):
+        # one pass over the memory objects into a new buffer
+        return array('d', map(_get_value, self.handles))
+
+    def diff(self):
+        # read the block and return the [(dev, val)] whose quantized value changed
+        new = self.read()
+        old = self.buffer
+        self.buffer = new
+        if new == old:
+            return []
+        changes = []
+        kind = self.kind
+        quant = self.quant
+        for i, (old_val, val) in enumerate(zip(old, new)):
+            if old_val != val:
+                q = quantize(kind, val)
+                if q != quant[i]:
+                    quant[i] = q
+                    changes.append((self.devs[i], val != 0.0 if kind == KIND_BIT else val))
+        return changes
+
+    def current(self):
+        # read the block and return [(dev, val)] for every device,
+        # recording the values as the last read
+        new = self.read()
+        self.buffer = new
+        kind = self.kind
+        self.quant = array('q', [quantize(kind, val) for val in new])
+        if kind == KIND_BIT:
+            return [(dev, val != 0.0) for dev, val in zip(self.devs, new)]
+        return list(zip(self.devs, new))
+
+    def current_changes(self, status: ArrayStatus):
+        # read the block like current(), but return only the [(dev, val)] whose
+        # quantized value differs from the status, found by one comparison of the block
+        new = self.read()
+        self.buffer = new
+        kind = self.kind
+        self.quant = array('q', [quantize(kind, val) for val in new])
+        devs = self.devs
+        if kind == KIND_BIT:
+            return [(devs[i], new[i] != 0.0) for i in status.diff(self.slots, self.quant)]
+        return [(devs[i], new[i]) for i in status.diff(self.slots, self.quant)]
+
+    def refresh(self, i, val):
+        # the status of device i was set outside of a read (an action): record val as
+        # reported and forget the last read, so the next read reports the memory value
+        # whenever it differs from val
+        self.quant[i] = quantize(self.kind, val)
+        self.buffer[i] = math.nan
+
+
+class MemorySnapshot(object):
+    # Read the memory map block by block instead of device by device.
+    # Devices are grouped by (memory type, datatype); the memory objects of each
+    # block are resolved once and re-read after every memory_map.Instance.Update().
+    # Only Bit and Float devices are captured (DateTime is read separately).
+    # changes() and current() can be limited to one memory type, so outputs can
+    # be read after the inputs were handled and the writes of that tick applied.
+    # This should be used when memory map is locked
+    def __init__(self, dev_list: List[Device]):
+        groups = dict()
+        for dev in dev_list:
+            if dev.datatype not in ('Bit', 'Float'):
+                continue
+            groups.setdefault((dev.typ, dev.datatype), []).append(dev)
+        self.blocks = [SnapshotBlock(typ, datatype, devs) for (typ, datatype), devs in groups.items()]
+        # {dev: (block, index in the block)}
+        self.index = {dev: (block, i) for block in self.blocks for i, dev in enumerate(block.devs)}
+        self.bound = False
+
+    def bind(self, meta_info):
+        for block in self.blocks:
+            block.bind(meta_info)
+        self.bound = True
+
+    def read(self):
+        # read all blocks without recording the values (used for dry runs)
+        return [block.read() for block in self.blocks]
+
+    def changes(self, typ=None):
+        # return [(dev, val)] of devices (of memory type typ) changed since the
+        # previous call, in the order of the blocks (i.e., the order of dev_list)
+        changes = []
+        for block in self.blocks:
+            if typ is not None and block.typ != typ:
+                continue
+            block_changes = block.diff()
+            if block_changes:
+                changes.extend(block_changes)
+        return changes
+
+    def current(self, typ=None, status=None):
+        # return [(dev, val)] of all devices of memory type typ (used by full reconciliation polls);
+        # with an ArrayStatus, only the devices whose value differs from the status are returned
+        values = []
+        for block in self.blocks:
+            if typ is not None and block.typ != typ:
+                continue
+            if isinstance(status, ArrayStatus) and block.slots is not None:
+                values.extend(block.current_changes(status))
+            else:
+                values.extend(block.current())
+        return values
+
+    def refresh(self, dev: Device, val):
+        # keep the snapshot in line with a status update made outside of the tick's reads
+        entry = self.index.get(dev)
+        if entry is not None:
+            block, i = entry
+            block.refresh(i, val)
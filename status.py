@@ -1,8 +1,28 @@
 from typing import List, Dict, Any, Tuple
+from array import array
+import datetime
 import math
 
 from device import Device
 
+# kinds of values (see quantize)
+KIND_BIT = 0
+KIND_FLOAT = 1
+KIND_OTHER = 2
+
+# quantized value of a device whose status is still unknown (None)
+QUANT_UNKNOWN = -(1 << 63)
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def quantize(kind, val):
+    # the value used for change detection: floats are compared at 0.1 resolution
+    if kind == KIND_FLOAT:
+        return math.floor(val * 10)
+    return 1 if val else 0
+
+
 class Status(object):
     def __init__(self, device_list: List[Device], virtual_device_list: List[Device]):
         # track status of regular devices
@@ -33,7 +53,7 @@ class Status(object):
         else:
             raise Exception("the device with address %d is not found." % dev.address)
         if dev.datatype == 'Float' and current_val is not None:
-            return math.floor(val * 10) == math.floor(current_val * 10)
+            return quantize(KIND_FLOAT, val) == quantize(KIND_FLOAT, current_val)
         else:
             return val == current_val
 
@@ -65,3 +85,109 @@ class Status(object):
 
     def update_time(self, time):
         self.time = time
+
+
+class ArrayStatus(object):
+    # Same API as Status, but every device owns a fixed slot (see
+    # device.assign_slots) and its state lives in typed arrays:
+    #   values:       last value (bits are stored as 0.0/1.0)
+    #   quant:        quantized value used by compare_status/diff
+    #   last_updated: simulated time of the last update, in epoch seconds
+    #   update_id:    number of updates (mod 1048576)
+    # Values of devices that are neither Bit nor Float are kept in a dict.
+    def __init__(self, device_list: List[Device], virtual_device_list: List[Device]):
+        devices = list(device_list) + list(virtual_device_list)
+        size = max([dev.slot for dev in devices]) + 1 if devices else 0
+        self.devices = [None] * size
+        self.slot_map = dict()
+        kinds = [KIND_OTHER] * size
+        for dev in devices:
+            if dev.slot is None:
+                raise Exception("the device with address %d has no slot." % dev.address)
+            self.devices[dev.slot] = dev
+            self.slot_map[dev] = dev.slot
+            if dev.datatype == 'Bit':
+                kinds[dev.slot] = KIND_BIT
+            elif dev.datatype == 'Float':
+                kinds[dev.slot] = KIND_FLOAT
+        self.kind = array('b', kinds)
+        self.values = array('d', [0.0] * size)
+        self.quant = array('q', [QUANT_UNKNOWN] * size)
+        self.last_updated = array('d', [math.nan] * size)
+        self.update_id = array('l', [0] * size)
+        self.objects = dict()
+        # track time
+        self.time = None
+        self.time_epoch = math.nan
+
+    def _slot(self, dev: Device):
+        slot = dev.slot
+        if slot is None or slot >= len(self.devices) or self.devices[slot] is not dev:
+            slot = self.slot_map.get(dev)
+            if slot is None:
+                raise Exception("the device with address %d is not found." % dev.address)
+        return slot
+
+    def check_status(self, dev: Device):
+        slot = self._slot(dev)
+        kind = self.kind[slot]
+        if kind == KIND_OTHER:
+            return self.objects.get(slot)
+        if self.quant[slot] == QUANT_UNKNOWN:
+            return None
+        if kind == KIND_BIT:
+            return self.values[slot] != 0.0
+        return self.values[slot]
+
+    def compare_status(self, dev: Device, val):
+        slot = self._slot(dev)
+        kind = self.kind[slot]
+        if kind == KIND_OTHER:
+            return val == self.objects.get(slot)
+        return quantize(kind, val) == self.quant[slot]
+
+    def update_status(self, dev: Device, val):
+        slot = self._slot(dev)
+        kind = self.kind[slot]
+        if kind == KIND_OTHER:
+            self.objects[slot] = val
+        else:
+            self.values[slot] = val
+            self.quant[slot] = quantize(kind, val)
+        self.last_updated[slot] = self.time_epoch
+        update_id = (self.update_id[slot] + 1) % 1048576
+        self.update_id[slot] = update_id
+        return update_id
+
+    def diff(self, slots, quant):
+        # compare the quantized values of the slots (a range or a list) with quant
+        # in one go and return the indexes (into slots) of the values that differ
+        if isinstance(slots, range) and slots.step == 1:
+            current = self.quant[slots.start:slots.stop]
+        else:
+            current = array('q', map(self.quant.__getitem__, slots))
+        if current == quant:
+            return []
+        return [i for i, (old, new) in enumerate(zip(current, quant)) if old != new]
+
+    def check_update_time_and_id(self, dev):
+        slot = self._slot(dev)
+        last_updated = self.last_updated[slot]
+        if math.isnan(last_updated):
+            last_updated = None
+        else:
+            last_updated = _EPOCH + datetime.timedelta(seconds=last_updated)
+        return last_updated, self.update_id[slot]
+
+    def check_time(self):
+        return self.time
+
+    def update_time(self, time):
+        self.time = time
+        self.time_epoch = (time - _EPOCH).total_seconds() if time is not None else math.nan
+
+
+status_backends = {
+    'dict': Status,
+    'array': ArrayStatus,
+}
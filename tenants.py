@@ -0,0 +1,208 @@
+import argparse
+import heapq
+import json
+import threading
+import time
+
+from meta import MetaInfo
+from device import init_shared_dev_lists
+from topology import Topology, default_topology
+from memory_backend import load_memory_backend
+from monitor import start_monitor, monitor_tick, stop_monitor
+from network import NetworkRuntime
+from metrics import MetricsGroup, MetricsServer
+
+
+###################################################
+# multi-tenant connector
+# serves several houses from one process: one MetaInfo
+# per tenant (user code, memory map, topology), one
+# NetworkRuntime for all of them and a bounded pool of
+# monitor workers instead of a monitor thread per house.
+# The tenants file is JSON:
+# {"server_url": "...", "workers": 4,
+#  "tenants": [{"user_code": "...", "backend": "sim",
+#               "sim_script": null, "sim_time_scale": 1.0,
+#               "topology": null, "status_backend": "dict",
+#               "capture": "poll", "journal": null,
+#               "rule_poll_interval": 2, "rule_long_poll": null}, ...]}
+# Only "user_code" is required. EngineIO has a single
+# memory map per process, so at most one tenant can use
+# the 'engineio' backend.
+###################################################
+def load_tenants(path):
+    with open(path) as f:
+        config = json.load(f)
+    tenants = config['tenants']
+    if len(set(tenant['user_code'] for tenant in tenants)) != len(tenants):
+        raise Exception("duplicate user code in %s." % path)
+    if sum(tenant.get('backend', 'sim') == 'engineio' for tenant in tenants) > 1:
+        raise Exception("only one tenant can use the engineio backend.")
+    return config
+
+
+def make_tenants(tenants, server_url):
+    # one MetaInfo per tenant
+    topologies = [Topology.load(tenant['topology']) if tenant.get('topology') else default_topology()
+                  for tenant in tenants]
+    dev_lists = init_shared_dev_lists(topologies)
+    meta_infos = []
+    for tenant, topology, (dev_list, virtual_dev_list) in zip(tenants, topologies, dev_lists):
+        memory_map, memory_type, handler = load_memory_backend(
+            tenant.get('backend', 'sim'), time_scale=tenant.get('sim_time_scale', 1.0),
+            script=tenant.get('sim_script'))
+        meta_info = MetaInfo(memory_map, memory_type, handler, dev_list, virtual_dev_list, [],
+                             tenant['user_code'], server_url,
+                             status_backend=tenant.get('status_backend', 'dict'),
+                             journal_dir=tenant.get('journal'), topology=topology, tenant=tenant['user_code'])
+        meta_info.capture_mode = tenant.get('capture', 'poll')
+        meta_info.rule_poll_interval = tenant.get('rule_poll_interval', meta_info.rule_poll_interval)
+        meta_info.rule_long_poll = tenant.get('rule_long_poll', meta_info.rule_long_poll)
+        meta_infos.append(meta_info)
+    return meta_infos
+
+
+###################################################
+# monitor loops of several tenants on a bounded pool of
+# worker threads
+# the pool keeps a min-heap of [deadline, seq, tenant]:
+# a worker takes the tenant whose deadline comes first,
+# runs one tick (monitor.monitor_tick) and puts it back
+# with its next deadline (TickScheduler.next_deadline),
+# so a tenant is never ticked by two workers at once.
+# A tick that starts late because every worker was busy
+# is recorded by TickScheduler.late_start, i.e., it shows
+# in the tenant's tick_overruns_total and
+# tick_max_lateness_seconds metrics.
+# A tick that raises is logged and counted in the tenant's
+# tick_errors_total, and the tenant is put back as usual.
+###################################################
+class MonitorPool(object):
+    def __init__(self, meta_infos, workers=4, clock=time.monotonic):
+        self.meta_infos = list(meta_infos)
+        self.workers = workers
+        self.clock = clock
+        self.heap = []
+        self.seq = 0
+        # {id(meta_info): ticks run}, for the dry-run rounds
+        self.rounds = dict()
+        # tenants not stopped yet (in the heap or being ticked)
+        self.live = len(self.meta_infos)
+        self.condition = threading.Condition()
+        self.threads = []
+
+    def start(self):
+        now = self.clock()
+        for meta_info in self.meta_infos:
+            start_monitor(meta_info)
+            meta_info.scheduler.clock = self.clock
+            self.rounds[id(meta_info)] = 0
+            self._push(now, meta_info)
+        for i in range(min(self.workers, len(self.meta_infos))):
+            thread = threading.Thread(target=self._work, name='monitor-%d' % i)
+            thread.start()
+            self.threads.append(thread)
+
+    def join(self):
+        # returns once every tenant's exit_flag is set
+        for thread in self.threads:
+            thread.join()
+
+    def _push(self, deadline, meta_info):
+        heapq.heappush(self.heap, [deadline, self.seq, meta_info])
+        self.seq += 1
+
+    def _next(self):
+        # wait for the earliest deadline and take its tenant,
+        # None once every tenant has stopped
+        with self.condition:
+            while self.live:
+                if not self.heap:
+                    self.condition.wait()
+                    continue
+                deadline = self.heap[0][0]
+                now = self.clock()
+                if deadline <= now:
+                    deadline, _, meta_info = heapq.heappop(self.heap)
+                    return meta_info, now - deadline
+                self.condition.wait(deadline - now)
+            return None, 0.0
+
+    def _work(self):
+        while True:
+            meta_info, lateness = self._next()
+            if meta_info is None:
+                return
+            if meta_info.exit_flag:
+                try:
+                    stop_monitor(meta_info)
+                except Exception as exc:
+                    meta_info.logger_monitor.error('monitor stop failed: ' + str(exc))
+                with self.condition:
+                    self.live -= 1
+                    self.condition.notify_all()
+                continue
+            scheduler = meta_info.scheduler
+            scheduler.late_start(lateness)
+            rounds = self.rounds[id(meta_info)]
+            try:
+                monitor_tick(meta_info, rounds < meta_info.dry_run_rounds)
+            except Exception as exc:
+                meta_info.metrics.tick_errors += 1
+                meta_info.logger_monitor.error('monitor tick failed: ' + str(exc))
+            self.rounds[id(meta_info)] = rounds + 1
+            deadline = scheduler.next_deadline()
+            with self.condition:
+                self._push(deadline, meta_info)
+                self.condition.notify()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Home I/O connector for TapDebug, several houses in one process')
+    parser.add_argument('tenants', help='JSON tenants file')
+    parser.add_argument('--server-url', default=None, help='overrides server_url of the tenants file')
+    parser.add_argument('--workers', type=int, default=None, help='monitor workers (overrides workers)')
+    parser.add_argument('--network-workers', type=int, default=4,
+                        help='threads running the short requests of all the tenants')
+    parser.add_argument('--upload-workers', type=int, default=2,
+                        help='threads running the trace uploads of all the tenants')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='serve the metrics of all the tenants on 127.0.0.1:<port>/metrics')
+    args = parser.parse_args()
+
+    config = load_tenants(args.tenants)
+    server_url = args.server_url or config.get('server_url')
+    if server_url is None:
+        server_url = input("Server url: ")
+    meta_infos = make_tenants(config['tenants'], server_url)
+
+    metrics_server = None
+    if args.metrics_port is not None:
+        metrics_server = MetricsServer(MetricsGroup([meta_info.metrics for meta_info in meta_infos]),
+                                       port=args.metrics_port)
+        metrics_server.start()
+
+    pool = MonitorPool(meta_infos, args.workers or config.get('workers', 4))
+    pool.start()
+
+    network_runtime = NetworkRuntime(meta_infos, max_workers=args.network_workers,
+                                     upload_workers=args.upload_workers)
+    network_thread = threading.Thread(target=network_runtime.run)
+    network_thread.start()
+
+    while True:
+        s = input("Input 'q' to exit: \n")
+        if s == 'q':
+            for meta_info in meta_infos:
+                meta_info.exit_flag = True
+            pool.join()
+            network_thread.join()
+            for meta_info in meta_infos:
+                meta_info.trace.close()
+            if metrics_server is not None:
+                metrics_server.stop()
+            break
+
+
+if __name__ == '__main__':
+    main()
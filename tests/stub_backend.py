@@ -0,0 +1,129 @@
+###################################################
+# a stub of the TapDebug backend for the tests
+# serves get_rules_and_devs (with ETag/If-None-Match and
+# the 'wait' long-poll parameter), get_cookie and the
+# POST endpoints on 127.0.0.1, on a port picked by the OS.
+###################################################
+import hashlib
+import json
+import logging
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from meta import MetaInfo
+from device import init_dev_list
+from memory_backend import load_memory_backend
+
+
+def make_meta_info(server_url, user_code='user1'):
+    # a MetaInfo on the simulated memory map, logging warnings only
+    memory_map, memory_type, handler = load_memory_backend('sim')
+    dev_list, virtual_dev_list = init_dev_list()
+    meta_info = MetaInfo(memory_map, memory_type, handler, dev_list, virtual_dev_list, [],
+                         user_code, server_url)
+    for logger in (meta_info.logger_rule, meta_info.logger_monitor, meta_info.logger_trace):
+        logger.setLevel(logging.WARNING)
+    return meta_info
+
+
+def dev_json(typ, datatype, address, name=None):
+    return {'typ': typ, 'data_typ': datatype, 'address': address,
+            'name': name if name is not None else '%s%s%d' % (typ, datatype, address)}
+
+
+def rule_json(trigger_address, action_address, val=True):
+    return {
+        'trigger': {'dev': dev_json('i', 'b', trigger_address), 'comp': '=', 'val': True, 'hold_t': None},
+        'conditions': [],
+        'action': {'dev': dev_json('o', 'b', action_address), 'comp': '=', 'val': val},
+    }
+
+
+class StubBackend(object):
+    def __init__(self, etag_support=True, hold_support=True):
+        self.etag_support = etag_support
+        self.hold_support = hold_support
+        self.rules = []
+        self.devs = []
+        self.loc_token = 'token'
+        self.pending_trace = False
+        # [(path, query, If-None-Match)] of the rule fetches
+        self.fetches = []
+        # [(path, json body)]
+        self.posts = []
+        # JSON answer to the POSTs
+        self.post_reply = {'cache_token': 'cache'}
+        self.condition = threading.Condition()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.thread = None
+
+    @property
+    def url(self):
+        # server_url of a MetaInfo
+        return '127.0.0.1:%d' % self.server.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def update(self, **changes):
+        # change rules/devs/loc_token/pending_trace/post_reply, wakes up the held requests
+        with self.condition:
+            for key, val in changes.items():
+                setattr(self, key, val)
+            self.condition.notify_all()
+
+    def body(self):
+        return json.dumps({'rules': self.rules, 'devs': self.devs, 'loc_token': self.loc_token,
+                           'pending_trace': self.pending_trace}).encode()
+
+    def _handler(self):
+        backend = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, code, body=b'', headers=()):
+                self.send_response(code)
+                for key, val in headers:
+                    self.send_header(key, val)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path.endswith('/get_cookie/'):
+                    self._send(200, headers=[('Set-Cookie', 'csrftoken=csrf; Path=/')])
+                    return
+                query = parse_qs(url.query)
+                if_none_match = self.headers.get('If-None-Match')
+                with backend.condition:
+                    backend.fetches.append((url.path, query, if_none_match))
+                    body = backend.body()
+                    etag = '"%s"' % hashlib.sha1(body).hexdigest()
+                    if 'wait' in query and backend.hold_support:
+                        deadline = time.monotonic() + float(query['wait'][0])
+                        while if_none_match == etag and time.monotonic() < deadline:
+                            backend.condition.wait(deadline - time.monotonic())
+                            body = backend.body()
+                            etag = '"%s"' % hashlib.sha1(body).hexdigest()
+                if backend.etag_support and if_none_match == etag:
+                    self._send(304)
+                    return
+                self._send(200, body, [('ETag', etag)] if backend.etag_support else [])
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                backend.posts.append((self.path, json.loads(self.rfile.read(length))))
+                self._send(200, json.dumps(backend.post_reply).encode())
+
+        return Handler
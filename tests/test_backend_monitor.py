@@ -0,0 +1,257 @@
+import datetime
+import os
+import sys
+import threading
+import time
+import unittest
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from backend_monitor import fetch_rules_and_devs, update_rules_and_devs, rule_dev_monitor, upload_traces, \
+    push_monitored_status
+from dev_monitor import monitor_status_change
+from traces import TraceStore
+from stub_backend import StubBackend, rule_json, make_meta_info
+
+
+class FetchRulesTest(unittest.TestCase):
+    def setUp(self):
+        self.backend = StubBackend().start()
+        self.backend.update(rules=[rule_json(0, 1)])
+        self.meta_info = make_meta_info(self.backend.url)
+        self.client = requests.session()
+
+    def tearDown(self):
+        self.client.close()
+        self.backend.stop()
+
+    def test_not_modified(self):
+        response_json = fetch_rules_and_devs(self.meta_info, self.client)
+        self.assertEqual(response_json['rules'], [rule_json(0, 1)])
+        self.assertIsNotNone(self.meta_info.rule_etag)
+
+        self.assertIsNone(fetch_rules_and_devs(self.meta_info, self.client))
+        # the second fetch sent the ETag of the first response
+        self.assertEqual(self.backend.fetches[-1][2], self.meta_info.rule_etag)
+
+        self.backend.update(rules=[rule_json(0, 2)])
+        response_json = fetch_rules_and_devs(self.meta_info, self.client)
+        self.assertEqual(response_json['rules'], [rule_json(0, 2)])
+
+    def test_same_fingerprint_without_etag(self):
+        self.backend.etag_support = False
+        self.assertIsNotNone(fetch_rules_and_devs(self.meta_info, self.client))
+        self.assertIsNone(self.meta_info.rule_etag)
+        # same body, skipped by its fingerprint
+        self.assertIsNone(fetch_rules_and_devs(self.meta_info, self.client))
+        self.assertIsNone(self.backend.fetches[-1][2])
+
+        self.backend.update(pending_trace=True)
+        response_json = fetch_rules_and_devs(self.meta_info, self.client)
+        self.assertTrue(response_json['pending_trace'])
+
+    def test_rules_installed_only_when_they_change(self):
+        update_rules_and_devs(self.meta_info, fetch_rules_and_devs(self.meta_info, self.client))
+        rule_set = self.meta_info.rule_set
+        self.assertEqual(len(rule_set.rules), 1)
+
+        # a new location token changes the response, not the rules
+        self.backend.update(loc_token='token2')
+        update_rules_and_devs(self.meta_info, fetch_rules_and_devs(self.meta_info, self.client))
+        self.assertEqual(self.meta_info.loc_token, 'token2')
+        self.assertIs(self.meta_info.rule_set, rule_set)
+
+        self.backend.update(rules=[rule_json(0, 1), rule_json(0, 2)])
+        update_rules_and_devs(self.meta_info, fetch_rules_and_devs(self.meta_info, self.client))
+        self.assertEqual(len(self.meta_info.rule_set.rules), 2)
+        self.assertEqual(self.meta_info.rule_set.version, rule_set.version + 1)
+
+
+class LongPollTest(unittest.TestCase):
+    def setUp(self):
+        self.backend = StubBackend()
+        self.meta_info = make_meta_info(self.backend.url)
+        self.meta_info.rule_poll_interval = 0.2
+        self.meta_info.rule_long_poll = 5
+        self.thread = threading.Thread(target=rule_dev_monitor, args=(self.meta_info,))
+
+    def tearDown(self):
+        self.meta_info.exit_flag = True
+        # release a held request
+        self.backend.update(loc_token='exit')
+        self.thread.join(10)
+        self.backend.stop()
+
+    def test_held_request_returns_on_change(self):
+        self.backend.update(rules=[rule_json(0, 1)])
+        self.backend.start()
+        self.thread.start()
+        time.sleep(0.5)
+        fetches = len(self.backend.fetches)
+        # the first request got the rules, the next one is held
+        self.assertEqual(fetches, 2)
+        self.assertEqual(self.backend.fetches[-1][1]['wait'], ['5'])
+
+        self.backend.update(rules=[rule_json(0, 1), rule_json(0, 2)])
+        time.sleep(0.3)
+        self.assertEqual(len(self.meta_info.rule_set.rules), 2)
+
+    def test_fallback_to_interval(self):
+        # a backend that does not hold requests answers 304 right away,
+        # the monitor then polls at rule_poll_interval instead of spinning
+        self.backend.hold_support = False
+        self.backend.update(rules=[rule_json(0, 1)])
+        self.backend.start()
+        self.thread.start()
+        time.sleep(1.1)
+        fetches = len(self.backend.fetches)
+        self.assertGreaterEqual(fetches, 3)
+        self.assertLessEqual(fetches, 8)
+        self.assertEqual(len(self.meta_info.rule_set.rules), 1)
+
+
+class UploadResponse(object):
+    def __init__(self, status_code, cache_token):
+        self.status_code = status_code
+        self.cache_token = cache_token
+
+    def json(self):
+        return {'cache_token': self.cache_token}
+
+
+class UploadClient(object):
+    # answers the trace uploads without a server, the POSTs in failing get a 500;
+    # on_post is called before answering, like the monitor recording in the meantime
+    def __init__(self, failing=(), on_post=None):
+        self.headers = {'X-CSRFToken': 'csrf'}
+        self.failing = failing
+        self.on_post = on_post
+        self.posts = []
+
+    def post(self, url, json=None, timeout=None):
+        self.posts.append(json)
+        if self.on_post is not None:
+            self.on_post()
+        if len(self.posts) in self.failing:
+            return UploadResponse(500, None)
+        return UploadResponse(200, 'cache%d' % len(self.posts))
+
+
+class UploadTracesTest(unittest.TestCase):
+    def setUp(self):
+        self.meta_info = make_meta_info('localhost')
+        self.meta_info.upload_batchsize = 4
+        self.dev = [dev for dev in self.meta_info.dev_list if dev.datatype == 'Float'][0]
+        self.recorded = 0
+
+    def record(self, count):
+        start = datetime.datetime(2021, 1, 1, 8, 0, 0)
+        for _ in range(count):
+            self.meta_info.trace.record(self.dev, float(self.recorded),
+                                        start + datetime.timedelta(seconds=self.recorded))
+            self.recorded += 1
+
+    def uploaded(self, client):
+        return [[entry['val'] for entry in data['trace']] for data in client.posts]
+
+    def test_resume_after_failed_batch(self):
+        self.record(10)
+        client = self.meta_info.trace_client = UploadClient(failing=(2,))
+        upload_traces(self.meta_info)
+        self.assertEqual(self.uploaded(client), [[0.0, 1.0, 2.0, 3.0], [4.0, 5.0, 6.0, 7.0]])
+        # the first batch was acknowledged, the second one was not
+        self.assertEqual(self.meta_info.trace_cursor, 4)
+        self.assertEqual(self.meta_info.trace_cache_token, 'cache1')
+
+        self.record(1)
+        client = self.meta_info.trace_client = UploadClient()
+        upload_traces(self.meta_info)
+        self.assertEqual(self.uploaded(client), [[4.0, 5.0, 6.0, 7.0], [8.0, 9.0, 10.0]])
+        self.assertEqual(client.posts[0]['cache_token'], 'cache1')
+        self.assertEqual([data['last'] for data in client.posts], [False, True])
+        self.assertEqual(self.meta_info.trace_cursor, 11)
+        self.assertEqual(self.meta_info.trace_cache_token, '')
+        self.assertEqual(self.meta_info.trace_skipped, 0)
+
+    def test_ring_overwritten_during_upload(self):
+        meta_info = self.meta_info
+        meta_info.trace = TraceStore(meta_info.dev_list + meta_info.virtual_dev_list, 6, 'overwrite')
+        meta_info.upload_batchsize = 2
+        self.record(6)
+        # 5 entries are recorded while the first batch is sent (the second one
+        # has already been read), entry 4 of the third batch is overwritten
+        client = meta_info.trace_client = UploadClient(
+            on_post=lambda: self.record(5) if len(client.posts) == 1 else None)
+        upload_traces(meta_info)
+        self.assertEqual(self.uploaded(client), [[0.0, 1.0], [2.0, 3.0], [5.0]])
+        self.assertEqual(meta_info.trace_skipped, 1)
+        # the entries recorded during the upload go to the next one
+        self.assertEqual(meta_info.trace_cursor, 6)
+
+        # the next upload starts after the entries overwritten in the meantime
+        self.record(4)
+        client = meta_info.trace_client = UploadClient()
+        upload_traces(meta_info)
+        self.assertEqual(self.uploaded(client), [[9.0, 10.0], [11.0, 12.0], [13.0, 14.0]])
+        self.assertEqual(meta_info.trace_skipped, 4)
+        self.assertEqual(meta_info.trace_cursor, 15)
+
+
+class PushStatusTest(unittest.TestCase):
+    def setUp(self):
+        self.backend = StubBackend().start()
+        self.meta_info = make_meta_info(self.backend.url)
+        self.devs = [dev for dev in self.meta_info.dev_list if dev.datatype == 'Bit'][:3]
+        self.meta_info.monitored_devs = {dev: None for dev in self.devs}
+        self.client = requests.session()
+
+    def tearDown(self):
+        self.client.close()
+        self.backend.stop()
+
+    def push(self, *changes):
+        for dev, val in changes:
+            monitor_status_change(dev, val, self.meta_info)
+        posts = len(self.backend.posts)
+        push_monitored_status(self.meta_info, self.client)
+        return [data for _, data in self.backend.posts[posts:]]
+
+    def test_changes_then_resync(self):
+        # the first push is a full one
+        (data,) = self.push((self.devs[0], True))
+        self.assertEqual((data['seq'], data['full'], len(data['update'])), (1, True, 3))
+        self.assertFalse(self.meta_info.status_push_resync)
+        # then only the changed devices, coalesced
+        (data,) = self.push((self.devs[1], True), (self.devs[1], False))
+        self.assertEqual((data['seq'], data['full']), (2, False))
+        self.assertEqual([(entry['dev_address'], entry['val']) for entry in data['update']],
+                         [(self.devs[1].address, False)])
+        # nothing changed, nothing sent
+        self.assertEqual(self.push(), [])
+
+        # the backend missed a push and asks for all the devices
+        self.backend.update(post_reply={'resync': True})
+        (data,) = self.push((self.devs[2], True))
+        self.assertEqual((data['seq'], data['full']), (3, False))
+        self.assertTrue(self.meta_info.status_push_resync)
+        self.backend.update(post_reply={})
+        (data,) = self.push()
+        self.assertEqual((data['seq'], data['full']), (4, True))
+        self.assertEqual({entry['dev_address']: entry['val'] for entry in data['update']},
+                         {self.devs[0].address: True, self.devs[1].address: False, self.devs[2].address: True})
+        self.assertFalse(self.meta_info.status_push_resync)
+
+    def test_reply_that_is_not_an_object(self):
+        self.push((self.devs[0], True))
+        for i, reply in enumerate([[], 'ok', None]):
+            self.backend.update(post_reply=reply)
+            (data,) = self.push((self.devs[0], i % 2 == 0))
+            self.assertEqual(data['seq'], i + 2)
+            self.assertFalse(self.meta_info.status_push_resync)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import datetime
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from rule import ClockIndex
+from rule_decoder import json_to_rule_list
+from stub_backend import dev_json
+
+
+def clock_rule_json(clock, action_address, comp='='):
+    return {
+        'trigger': {'dev': dev_json('m', 'dt', 65), 'comp': comp, 'val': clock, 'hold_t': None},
+        'conditions': [],
+        'action': {'dev': dev_json('o', 'b', action_address), 'comp': '=', 'val': True},
+    }
+
+
+def at(day, hour, minute, second=0):
+    return datetime.datetime(2021, 1, day, hour, minute, second)
+
+
+class ClockIndexTest(unittest.TestCase):
+    def setUp(self):
+        # the action address tells the rules apart
+        rules = json_to_rule_list({'rules': [clock_rule_json('09:00', 1), clock_rule_json('08:30', 2),
+                                             clock_rule_json('07:00', 3), clock_rule_json('08:30', 4)]})
+        self.index = ClockIndex()
+        for rule_id, rule in enumerate(rules):
+            self.index.add(rule_id, rule)
+
+    def due(self, old_time, new_time):
+        return [rule.action.var.address for _, rule in self.index.due(old_time, new_time)]
+
+    def test_minute_crossed(self):
+        self.assertEqual(self.due(at(1, 8, 29, 30), at(1, 8, 30)), [2, 4])
+        self.assertEqual(self.due(at(1, 8, 30), at(1, 8, 30, 59)), [])
+        self.assertEqual(self.due(at(1, 8, 29, 59), at(1, 8, 31)), [2, 4])
+        # in the order the minutes were crossed
+        self.assertEqual(self.due(at(1, 6, 0), at(1, 9, 0)), [3, 2, 4, 1])
+
+    def test_zero_length_and_backward_jumps(self):
+        self.assertEqual(self.due(at(1, 8, 30), at(1, 8, 30)), [])
+        self.assertEqual(self.due(at(1, 9, 30), at(1, 8, 0)), [])
+        self.assertEqual(self.due(at(2, 8, 0), at(1, 8, 45)), [])
+        self.assertEqual(self.due(None, at(1, 8, 30)), [])
+
+    def test_jumps_of_a_day_or_more(self):
+        # every rule fires once, from the first minute crossed on
+        self.assertEqual(self.due(at(1, 8, 0), at(2, 8, 0)), [2, 4, 1, 3])
+        self.assertEqual(self.due(at(1, 8, 0), at(4, 12, 0)), [2, 4, 1, 3])
+        # across midnight
+        self.assertEqual(self.due(at(1, 23, 0), at(2, 8, 30)), [3, 2, 4])
+
+    def test_other_comparators(self):
+        rule, = json_to_rule_list({'rules': [clock_rule_json('22:00', 5, '>=')]})
+        self.index.add(4, rule)
+        self.assertEqual(self.due(at(1, 21, 0), at(1, 23, 0)), [5])
+        # once per jump, even when many crossed minutes match
+        self.assertEqual(self.due(at(1, 6, 0), at(3, 6, 0)), [3, 2, 4, 1, 5])
+        self.assertEqual(self.due(at(1, 8, 0), at(1, 9, 0)), [2, 4, 1])
+
+    def test_next_due(self):
+        self.assertEqual(self.index.next_due(at(1, 8, 10, 20)), at(1, 8, 30))
+        self.assertEqual(self.index.next_due(at(1, 8, 30)), at(1, 9, 0))
+        self.assertEqual(self.index.next_due(at(1, 9, 30)), at(2, 7, 0))
+        self.assertIsNone(ClockIndex().next_due(at(1, 8, 0)))
+
+
+if __name__ == '__main__':
+    unittest.main()
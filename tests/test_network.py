@@ -0,0 +1,82 @@
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from network import NetworkRuntime
+from stub_backend import StubBackend, dev_json, rule_json, make_meta_info
+
+
+def bad_rule_json():
+    # the constant of a Float condition that is not a number
+    rule = rule_json(0, 1)
+    rule['conditions'] = [{'dev': dev_json('i', 'f', 0), 'comp': '>', 'val': 'warm'}]
+    return rule
+
+
+class NetworkRuntimeTest(unittest.TestCase):
+    def setUp(self):
+        self.backend = StubBackend().start()
+        self.meta_info = make_meta_info(self.backend.url)
+        self.meta_info.rule_poll_interval = 0.1
+        self.meta_info.status_push_window = 0.1
+        self.runtime = NetworkRuntime(self.meta_info)
+        self.thread = threading.Thread(target=self.runtime.run)
+
+    def tearDown(self):
+        self.meta_info.exit_flag = True
+        self.thread.join(10)
+        self.backend.stop()
+
+    def test_bad_rule_does_not_stop_polling(self):
+        self.backend.update(rules=[rule_json(0, 1), bad_rule_json()])
+        with self.assertLogs(self.meta_info.logger_rule, 'WARNING') as logs:
+            self.thread.start()
+            time.sleep(0.5)
+        self.assertTrue(any('rule update failed' in line for line in logs.output))
+        self.assertTrue(self.thread.is_alive())
+        self.assertEqual(len(self.meta_info.rule_set.rules), 0)
+
+        self.backend.update(rules=[rule_json(0, 1)])
+        time.sleep(0.5)
+        self.assertTrue(self.thread.is_alive())
+        self.assertEqual(len(self.meta_info.rule_set.rules), 1)
+
+
+class BatchedPollTest(unittest.TestCase):
+    def setUp(self):
+        self.backend = StubBackend().start()
+        self.fast = make_meta_info(self.backend.url, 'user1')
+        self.fast.rule_poll_interval = 0.1
+        self.slow = make_meta_info(self.backend.url, 'user2')
+        self.slow.rule_poll_interval = 0.5
+        self.meta_infos = [self.fast, self.slow]
+        for meta_info in self.meta_infos:
+            meta_info.status_push_window = 0.1
+        self.runtime = NetworkRuntime(self.meta_infos)
+        self.thread = threading.Thread(target=self.runtime.run)
+
+    def tearDown(self):
+        for meta_info in self.meta_infos:
+            meta_info.exit_flag = True
+        self.thread.join(10)
+        self.backend.stop()
+
+    def fetches(self, user_code):
+        return len([fetch for fetch in self.backend.fetches if fetch[1]['user_code'] == [user_code]])
+
+    def test_each_house_at_its_interval(self):
+        self.thread.start()
+        time.sleep(1.2)
+        # about 11 polls of user1, 3 of user2 (at 0, 0.5 and 1.0 s)
+        self.assertGreaterEqual(self.fetches('user1'), 7)
+        self.assertGreaterEqual(self.fetches('user2'), 2)
+        self.assertLessEqual(self.fetches('user2'), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import datetime
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from device import Device
+from traces import generate_trace_entry
+from replay import replay
+from stub_backend import dev_json, rule_json
+
+
+def clock_rule_json(clock, action_address):
+    return {
+        'trigger': {'dev': dev_json('m', 'dt', 65), 'comp': '=', 'val': clock, 'hold_t': None},
+        'conditions': [],
+        'action': {'dev': dev_json('o', 'b', action_address), 'comp': '=', 'val': True},
+    }
+
+
+def input_entry(address, val, hour, minute):
+    return generate_trace_entry(Device('Input', 'Bit', address), val,
+                                datetime.datetime(2021, 1, 1, hour, minute))
+
+
+class ReplayTest(unittest.TestCase):
+    def test_clock_rule_before_second_input(self):
+        # the rules are installed after the first timestamp, the clock rule is
+        # due between it and the second one
+        entries = [input_entry(0, False, 8, 0), input_entry(0, True, 9, 0)]
+        report = replay(entries, {'rules': [clock_rule_json('08:30', 1), rule_json(0, 2)]})
+        actions = [(action['timestamp'], action['dev_address']) for action in report['actions']]
+        self.assertEqual(actions, [('08:30:00 01/01/2021', 1), ('09:00:00 01/01/2021', 2)])
+
+
+if __name__ == '__main__':
+    unittest.main()
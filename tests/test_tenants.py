@@ -0,0 +1,132 @@
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from device import Device, init_dev_list, assign_slots
+from status import ArrayStatus
+from topology import Topology
+from tenants import make_tenants, MonitorPool
+from network import NetworkRuntime
+from stub_backend import StubBackend, rule_json, make_meta_info
+
+
+def quiet(meta_infos):
+    for meta_info in meta_infos:
+        for logger in (meta_info.logger_rule, meta_info.logger_monitor, meta_info.logger_trace):
+            logger.disabled = True
+    return meta_infos
+
+
+class MonitorPoolTest(unittest.TestCase):
+    def test_failing_tick_does_not_stop_the_pool(self):
+        meta_infos = quiet(make_tenants([{'user_code': 'user1'}, {'user_code': 'user2'}], 'localhost'))
+
+        def fail():
+            raise RuntimeError('flush failed')
+        meta_infos[0].trace.flush = fail
+
+        pool = MonitorPool(meta_infos, workers=1)
+        pool.start()
+        time.sleep(0.3)
+        for meta_info in meta_infos:
+            meta_info.exit_flag = True
+        joined = threading.Thread(target=pool.join)
+        joined.start()
+        joined.join(5)
+        self.assertFalse(joined.is_alive())
+        self.assertEqual(pool.live, 0)
+        # both tenants kept being ticked
+        self.assertGreater(meta_infos[0].metrics.tick_errors, 1)
+        self.assertEqual(meta_infos[0].metrics.tick_errors, meta_infos[0].metrics.ticks)
+        self.assertGreater(meta_infos[1].metrics.ticks, 1)
+        self.assertEqual(meta_infos[1].metrics.tick_errors, 0)
+
+
+class TenantsTest(unittest.TestCase):
+    def test_rule_polling_per_tenant(self):
+        meta_infos = make_tenants([{'user_code': 'user1'},
+                                   {'user_code': 'user2', 'rule_long_poll': 30, 'rule_poll_interval': 5}],
+                                  'localhost')
+        self.assertIsNone(meta_infos[0].rule_long_poll)
+        self.assertEqual(meta_infos[0].rule_poll_interval, 2)
+        self.assertEqual(meta_infos[1].rule_long_poll, 30)
+        self.assertEqual(meta_infos[1].rule_poll_interval, 5)
+
+
+class SlotTest(unittest.TestCase):
+    def test_another_house_keeps_the_slots(self):
+        dev_list, virtual_dev_list = init_dev_list()
+        status = ArrayStatus(dev_list, virtual_dev_list)
+        slots = [dev.slot for dev in dev_list + virtual_dev_list]
+
+        other = Topology({'devices': {'Input': {'Bit': [0, 9001]}}})
+        other_dev_list, _ = init_dev_list(other)
+        self.assertEqual([dev.slot for dev in dev_list + virtual_dev_list], slots)
+        self.assertEqual(other_dev_list[0].slot, Device('Input', 'Bit', 0).slot)
+        self.assertNotIn(other_dev_list[1].slot, slots)
+
+        other_status = ArrayStatus(other_dev_list, [])
+        other_status.update_status(other_dev_list[1], True)
+        status.update_status(dev_list[0], True)
+        self.assertTrue(other_status.check_status(other_dev_list[1]))
+        self.assertTrue(status.check_status(dev_list[0]))
+
+    def test_re_slotted_device(self):
+        dev_list, virtual_dev_list = init_dev_list()
+        dev = dev_list[0]
+        slot = dev.slot
+        dev.slot = dev_list[1].slot
+        try:
+            with self.assertRaises(Exception):
+                assign_slots([dev], [])
+        finally:
+            dev.slot = slot
+
+
+class SharedNetworkRuntimeTest(unittest.TestCase):
+    def setUp(self):
+        self.backend = StubBackend().start()
+        self.backend.update(rules=[rule_json(0, 1)])
+        self.polled = make_meta_info(self.backend.url, 'user1')
+        self.polled.rule_poll_interval = 0.1
+        self.long_polled = make_meta_info(self.backend.url, 'user2')
+        self.long_polled.rule_long_poll = 30
+        self.meta_infos = [self.polled, self.long_polled]
+        for meta_info in self.meta_infos:
+            meta_info.status_push_window = 0.1
+        # one thread for the short requests
+        self.runtime = NetworkRuntime(self.meta_infos, max_workers=1)
+        self.thread = threading.Thread(target=self.runtime.run)
+
+    def tearDown(self):
+        for meta_info in self.meta_infos:
+            meta_info.exit_flag = True
+        # release the held request
+        self.backend.update(loc_token='exit')
+        self.thread.join(10)
+        self.backend.stop()
+
+    def fetches(self, user_code):
+        return len([fetch for fetch in self.backend.fetches if fetch[1]['user_code'] == [user_code]])
+
+    def test_held_long_poll_does_not_block_other_tenants(self):
+        self.thread.start()
+        time.sleep(0.8)
+        # the long poll of user2 is held, user1 keeps polling
+        self.assertEqual(self.fetches('user2'), 2)
+        self.assertGreaterEqual(self.fetches('user1'), 4)
+        self.assertEqual(len(self.polled.rule_set.rules), 1)
+
+        self.backend.update(rules=[rule_json(0, 1), rule_json(0, 2)])
+        time.sleep(0.5)
+        for meta_info in self.meta_infos:
+            self.assertEqual(len(meta_info.rule_set.rules), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import datetime
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from timers import TimerQueue
+from rule import RuleSet
+from rule_decoder import json_to_rule_list
+from stub_backend import rule_json
+
+
+def hold_rule_json(trigger_address, action_address, hold_t):
+    rule = rule_json(trigger_address, action_address)
+    rule['trigger']['hold_t'] = hold_t
+    return rule
+
+
+class TimerQueueTest(unittest.TestCase):
+    def test_pop_due(self):
+        timers = TimerQueue()
+        timers.schedule('a', 10)
+        timers.schedule('b', 5)
+        timers.schedule('c', 7)
+        timers.schedule('d', 7)
+        self.assertEqual(len(timers), 4)
+        self.assertEqual(timers.next_target(), 5)
+        self.assertEqual(timers.pop_due(4), [])
+        self.assertEqual(timers.pop_due(5), ['b'])
+        # same target: in scheduling order
+        self.assertEqual(timers.pop_due(9), ['c', 'd'])
+        self.assertEqual(timers.next_target(), 10)
+        self.assertEqual(timers.pop_due(100), ['a'])
+        self.assertEqual((len(timers), timers.next_target()), (0, None))
+
+    def test_cancelled_timer_is_dropped_lazily(self):
+        timers = TimerQueue()
+        timers.schedule('a', 5)
+        timers.schedule('b', 6)
+        timers.cancel('a')
+        timers.cancel('missing')
+        self.assertNotIn('a', timers)
+        self.assertEqual((len(timers), len(timers.heap), timers.dead), (1, 2, 1))
+        # the dead entry goes once it reaches the top
+        self.assertEqual(timers.next_target(), 6)
+        self.assertEqual((len(timers.heap), timers.dead), (1, 0))
+
+        # rescheduling leaves the old entry dead
+        timers.schedule('b', 8)
+        self.assertEqual(timers.target('b'), 8)
+        self.assertEqual(timers.pop_due(7), [])
+        self.assertEqual(timers.dead, 0)
+        self.assertEqual(timers.pop_due(8), ['b'])
+
+    def test_heap_is_rebuilt_when_mostly_dead(self):
+        timers = TimerQueue()
+        for key in range(200):
+            timers.schedule(key, key)
+        for key in range(150):
+            timers.cancel(key)
+        self.assertEqual(len(timers), 50)
+        self.assertLess(len(timers.heap), 200)
+        self.assertEqual(timers.pop_due(1000), list(range(150, 200)))
+        self.assertEqual((len(timers.heap), timers.dead), (0, 0))
+
+
+class AdoptTimersTest(unittest.TestCase):
+    def test_kept_rules_keep_their_timers(self):
+        now = datetime.datetime(2021, 1, 1, 8, 0, 0)
+        kept, removed, added = hold_rule_json(0, 1, 60), hold_rule_json(0, 2, 60), hold_rule_json(3, 4, 30)
+        old = RuleSet(json_to_rule_list({'rules': [removed, kept]}))
+        for rule_id in old.rule_ids:
+            old.timers.schedule(rule_id, now + datetime.timedelta(seconds=60))
+
+        # the kept rule moved, the other one is gone
+        new = RuleSet(json_to_rule_list({'rules': [added, kept]}), old.version + 1)
+        new.adopt_timers(old)
+        kept_id = new.rule_ids[1]
+        self.assertEqual(kept_id, old.rule_ids[1])
+        self.assertEqual(list(new.timers.entries), [kept_id])
+        self.assertEqual(new.timers.target(kept_id), now + datetime.timedelta(seconds=60))
+        self.assertEqual(new.timers.pop_due(now + datetime.timedelta(seconds=60)), [kept_id])
+        self.assertIs(new.by_id[kept_id], new.rules[1])
+
+    def test_same_rule_reinstalled(self):
+        # a rule listed twice has two timers, both carried over when it comes back
+        now = datetime.datetime(2021, 1, 1, 8, 0, 0)
+        rules = [hold_rule_json(0, 1, 60), hold_rule_json(0, 1, 60)]
+        old = RuleSet(json_to_rule_list({'rules': rules}))
+        old.timers.schedule(old.rule_ids[0], now)
+        old.timers.schedule(old.rule_ids[1], now + datetime.timedelta(seconds=1))
+        new = RuleSet(json_to_rule_list({'rules': rules}), old.version + 1)
+        new.adopt_timers(old)
+        self.assertEqual(new.rule_ids, old.rule_ids)
+        self.assertEqual(new.timers.pop_due(now + datetime.timedelta(seconds=1)), list(old.rule_ids))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import datetime
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from device import init_dev_list
+from traces import TraceStore
+from journal import TraceJournal
+
+START = datetime.datetime(2021, 1, 1, 8, 0, 0)
+
+
+def record(trace, dev, count, first=0):
+    # entries first..first+count-1, entry i has the value i at START + i seconds
+    for i in range(first, first + count):
+        trace.record(dev, float(i), START + datetime.timedelta(seconds=i))
+
+
+def values(entries):
+    return [entry['val'] for entry in entries]
+
+
+class TraceStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.dev_list, self.virtual_dev_list = init_dev_list()
+        self.dev = [dev for dev in self.dev_list if dev.datatype == 'Float'][0]
+
+    def store(self, capacity, overflow):
+        return TraceStore(self.dev_list + self.virtual_dev_list, capacity, overflow)
+
+    def test_overwrite(self):
+        trace = self.store(4, 'overwrite')
+        record(trace, self.dev, 6)
+        self.assertEqual(trace.dropped, 2)
+        self.assertEqual((trace.oldest_seq, trace.next_seq, len(trace)), (2, 6, 4))
+        self.assertEqual(values(trace.entries()), [2.0, 3.0, 4.0, 5.0])
+        # a read from an overwritten entry starts at the oldest one
+        start, devs, *_ = trace.columns(0, 3)
+        self.assertEqual((start, len(devs)), (2, 1))
+
+    def test_overwrite_while_iterating(self):
+        trace = self.store(4, 'overwrite')
+        record(trace, self.dev, 4)
+        batches = trace.iter_batches(0, 4, 2)
+        batch_start, batch_stop, entries = next(batches)
+        self.assertEqual((batch_start, batch_stop, values(entries)), (0, 2, [0.0, 1.0]))
+        # entries 2 and 3 are overwritten before the next batch is read
+        record(trace, self.dev, 4, 4)
+        self.assertEqual(list(batches), [])
+
+        trace = self.store(4, 'overwrite')
+        record(trace, self.dev, 4)
+        batches = trace.iter_batches(0, 4, 2)
+        next(batches)
+        # only entry 2 is overwritten, the next batch starts at entry 3
+        record(trace, self.dev, 3, 4)
+        batch_start, batch_stop, entries = next(batches)
+        self.assertEqual((batch_start, batch_stop, values(entries)), (3, 4, [3.0]))
+
+    def test_drop(self):
+        trace = self.store(3, 'drop')
+        record(trace, self.dev, 5)
+        self.assertEqual(trace.dropped, 2)
+        self.assertEqual((trace.oldest_seq, trace.next_seq, len(trace)), (0, 3, 3))
+        self.assertEqual(values(trace.entries()), [0.0, 1.0, 2.0])
+
+    def test_grow(self):
+        trace = self.store(2, 'grow')
+        record(trace, self.dev, 5)
+        self.assertEqual(trace.dropped, 0)
+        self.assertEqual((trace.oldest_seq, trace.next_seq, len(trace)), (0, 5, 5))
+        self.assertEqual(values(trace.entries()), [0.0, 1.0, 2.0, 3.0, 4.0])
+        self.assertEqual(trace.entries(1, 2)[0]['timestamp'], '08:00:01 01/01/2021')
+
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        self.dev_list, self.virtual_dev_list = init_dev_list()
+        self.dev = [dev for dev in self.dev_list if dev.datatype == 'Float'][0]
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def store(self, capacity=4):
+        journal = TraceJournal(self.directory.name, segment_entries=4)
+        return TraceStore(self.dev_list + self.virtual_dev_list, capacity, journal=journal)
+
+    def test_restart_after_compacting_everything(self):
+        # the first run uploads its 10 entries
+        trace = self.store()
+        record(trace, self.dev, 10)
+        trace.flush()
+        trace.compact(10)
+        trace.close()
+        # the second run has nothing new: no segment is open, they all go
+        trace = self.store()
+        self.assertEqual(trace.acked_seq, 10)
+        trace.compact(trace.acked_seq)
+        self.assertEqual(trace.journal.segments, [])
+        trace.close()
+        # the third run numbers its entries after the uploaded ones
+        trace = self.store()
+        self.assertEqual((trace.next_seq, trace.acked_seq), (10, 10))
+        record(trace, self.dev, 5, 10)
+        self.assertEqual(values(trace.entries(trace.acked_seq)), [10.0, 11.0, 12.0, 13.0, 14.0])
+        trace.close()
+
+    def test_reads_from_the_tail_and_the_journal(self):
+        trace = self.store()
+        record(trace, self.dev, 10)
+        # the hot tail holds the last 4 entries, the journal all of them
+        self.assertEqual((trace.oldest_seq, trace.first_seq, len(trace)), (0, 6, 10))
+        self.assertEqual(values(trace.entries()), [float(i) for i in range(10)])
+        self.assertEqual([(start, stop) for start, stop, _ in trace.iter_batches(0, 10, 4)],
+                         [(0, 4), (4, 8), (8, 10)])
+        journal_read = trace.journal.read
+        trace.journal.read = None
+        self.assertEqual(values(trace.entries(6)), [6.0, 7.0, 8.0, 9.0])
+        trace.journal.read = journal_read
+        trace.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
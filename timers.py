@@ -0,0 +1,81 @@
+import heapq
+
+
+###################################################
+# timer queue for hold rules
+# ("if xxx has been true for x time, then ...")
+# a min-heap of [target time, sequence number, key, alive]
+# ordered by target time (ties in scheduling order).
+# Cancelling or rescheduling only marks the old entry
+# dead, dead entries are dropped when they reach the top
+# (and the heap is rebuilt once they are the majority),
+# so both cost O(1) plus an O(log n) push.
+# Keys are the stable rule ids of RuleSet, so timers
+# can be carried over to a new rule set.
+# This is only used by the monitor thread
+###################################################
+class TimerQueue(object):
+    def __init__(self):
+        self.heap = []
+        # {key: live heap entry}
+        self.entries = dict()
+        self.seq = 0
+        self.dead = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def target(self, key):
+        return self.entries[key][0]
+
+    def schedule(self, key, target):
+        # (re)schedule key at target, replacing its pending timer if any
+        self.cancel(key)
+        entry = [target, self.seq, key, True]
+        self.seq += 1
+        self.entries[key] = entry
+        heapq.heappush(self.heap, entry)
+
+    def cancel(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            entry[3] = False
+            self.dead += 1
+            if self.dead > 64 and self.dead > len(self.entries):
+                self._rebuild()
+
+    def _rebuild(self):
+        self.heap = [entry for entry in self.heap if entry[3]]
+        heapq.heapify(self.heap)
+        self.dead = 0
+
+    def pop_due(self, now):
+        # remove and return the keys whose target is not later than now,
+        # earliest first
+        due = []
+        heap = self.heap
+        while heap and heap[0][0] <= now:
+            target, seq, key, alive = heapq.heappop(heap)
+            if alive:
+                del self.entries[key]
+                due.append(key)
+            else:
+                self.dead -= 1
+        return due
+
+    def next_target(self):
+        # the earliest pending target, None if there is none
+        heap = self.heap
+        while heap and not heap[0][3]:
+            heapq.heappop(heap)
+            self.dead -= 1
+        return heap[0][0] if heap else None
+
+    def adopt(self, other, keys):
+        # take over the pending timers of other whose key is in keys
+        # (e.g., the rules kept by a new rule set), in their original order
+        for entry in sorted(e for e in other.entries.values() if e[2] in keys):
+            self.schedule(entry[2], entry[0])
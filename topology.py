@@ -0,0 +1,101 @@
+import json
+import os
+
+DEFAULT_HOUSE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'house.json')
+
+
+###################################################
+# house topology
+# the devices of a house layout, its default controllers
+# (wall switches wired to outputs) and its virtual devices
+# (shades, garage doors, alarm key pads built on top of
+# sensors and motor pairs), loaded from a data file
+# (see house.json). Addresses are plain integers:
+# switches and sensors are inputs, everything else outputs.
+# The dispatch table used at run time is compiled from it
+# by default_controller.
+###################################################
+class Topology(object):
+    def __init__(self, data):
+        # {(memory type, datatype): [addresses]}
+        self.devices = dict()
+        for typ, datatypes in data['devices'].items():
+            for datatype, addresses in datatypes.items():
+                self.devices[(typ, datatype)] = list(addresses)
+
+        controllers = data.get('controllers', {})
+        # SS: a single switch controlling binary outputs (flip)
+        # {switch: [outputs]}
+        self.ss = {c['switch']: list(c['outputs']) for c in controllers.get('ss', [])}
+        # SSD: a single switch controlling binary outputs (same status)
+        # {switch: [outputs]}
+        self.ssd = {c['switch']: list(c['outputs']) for c in controllers.get('ssd', [])}
+        # DS: two switches (up, down) controlling binary outputs
+        # {(up, down): [outputs]}
+        self.ds = {tuple(c['switches']): list(c['outputs']) for c in controllers.get('ds', [])}
+        # DD: two switches (up, down) controlling motor pairs (up motor, down motor)
+        # {(up, down): [(up motor, down motor)]}
+        self.dd = {tuple(c['switches']): [tuple(motors) for motors in c['motors']]
+                   for c in controllers.get('dd', [])}
+
+        vdevs = data.get('virtual_devices', {})
+        # {vdev: (openness sensor, (open motor, close motor))}
+        self.shades = {v['address']: (v['openness'], tuple(v['motors'])) for v in vdevs.get('shade', [])}
+        # {vdev: (closed sensor, opened sensor, (open motor, close motor))}
+        self.garage_doors = {v['address']: (v['closed'], v['opened'], tuple(v['motors']))
+                             for v in vdevs.get('garage_door', [])}
+        # {vdev: (armed sensor, (arm motor, disarm motor))}
+        self.alarm_key_pads = {v['address']: (v['armed'], tuple(v['motors']))
+                               for v in vdevs.get('alarm_key_pad', [])}
+
+        self._check()
+
+    def _check(self):
+        # a switch belongs to one controller, a motor to one virtual device
+        switches = list(self.ss) + list(self.ssd)
+        for group in list(self.ds) + list(self.dd):
+            switches.extend(group)
+        duplicates = {switch for switch in switches if switches.count(switch) > 1}
+        if duplicates:
+            raise Exception("switches %s are used by more than one controller." % sorted(duplicates))
+        motors = [motor for _, pair in self.vdev_motors() for motor in pair]
+        duplicates = {motor for motor in motors if motors.count(motor) > 1}
+        if duplicates:
+            raise Exception("motors %s are used by more than one virtual device." % sorted(duplicates))
+
+    def vdev_motors(self):
+        # [(vdev, (open motor, close motor))] of every virtual device
+        motors = [(vdev, pair) for vdev, (_, pair) in self.shades.items()]
+        motors += [(vdev, pair) for vdev, (_, _, pair) in self.garage_doors.items()]
+        motors += [(vdev, pair) for vdev, (_, pair) in self.alarm_key_pads.items()]
+        return motors
+
+    def motor_interlocks(self):
+        # {motor: opposite motor} of the motor pairs of virtual devices and DD controllers
+        interlocks = dict()
+        pairs = [pair for _, pair in self.vdev_motors()]
+        pairs += [pair for motor_groups in self.dd.values() for pair in motor_groups]
+        for motor, opposite in pairs:
+            interlocks[motor] = opposite
+            interlocks[opposite] = motor
+        return interlocks
+
+    def virtual_devices(self):
+        # addresses of the virtual devices, in the order of the data file sections
+        return list(self.shades) + list(self.garage_doors) + list(self.alarm_key_pads)
+
+    @classmethod
+    def load(cls, path=DEFAULT_HOUSE):
+        with open(path) as f:
+            return cls(json.load(f))
+
+
+_default = None
+
+
+def default_topology():
+    # the topology of DEFAULT_HOUSE, loaded once
+    global _default
+    if _default is None:
+        _default = Topology.load()
+    return _default
@@ -1,21 +1,225 @@
 import requests
 import datetime
-from meta import MetaInfo
+import math
+import threading
+from array import array
+from typing import List
+
 from device import Device
 
+_EPOCH = datetime.datetime(1970, 1, 1)
+
 
 ###################################################
 # upload the traces onto the server
 # called upon exit
 ###################################################
-def generate_trace_entry(dev: Device, val, timestamp: datetime.datetime, is_automated=False):
+def generate_trace_entry(dev: Device, val, timestamp: datetime.datetime, is_automated=False, name=None):
     entry = {
         'dev_datatype': dev.datatype,
         'dev_typ': dev.typ,
         'dev_address': dev.address,
-        'dev_name': dev.name,
+        'dev_name': dev.name if name is None else name,
         'val': val,
-        'timestamp': timestamp.strftime('%H:%M:%S %m/%d/%Y'),
+        'timestamp': timestamp.strftime('%H:%M:%S %m/%d/%Y') if timestamp is not None else None,
         'is_automated': is_automated
     }
     return entry
+
+
+###################################################
+# columnar store of trace entries
+# each entry is kept as (device slot, value, epoch seconds
+# of the simulated time, automated flag, name id) in parallel
+# arrays; the dict form (generate_trace_entry) is only built
+# when entries are read for upload.
+# The name of the device is the one of dev_names (the names
+# the tenant's backend gives to its devices) when the entry
+# is recorded, so renaming a device later does not change
+# the entries already recorded.
+# Entries are numbered by a sequence number that never
+# decreases: first_seq is the oldest entry still stored
+# and next_seq the number the next entry will get.
+# overflow policies once capacity entries are stored:
+#   'overwrite': drop the oldest entry (ring buffer)
+#   'drop':      drop the new entry
+#   'grow':      keep growing (capacity is ignored)
+# With a journal (see journal.TraceJournal), every entry
+# is also written to disk and the arrays only keep a hot tail
+# of the most recent entries (overwrite policy): reads of
+# entries still in the tail are served from the arrays, the
+# older ones from the journal.
+# The monitor thread records entries while the upload
+# reads them, so both sides go through self.lock; readers
+# only copy array slices under the lock.
+###################################################
+class TraceStore(object):
+    def __init__(self, devices: List[Device], capacity=1000000, overflow='overwrite', journal=None,
+                 dev_names=None):
+        if overflow not in ('overwrite', 'drop', 'grow'):
+            raise ValueError("unknown overflow policy: %s" % overflow)
+        if journal is not None:
+            overflow = 'overwrite'
+        # devices by slot
+        self.devices = [None] * (max([dev.slot for dev in devices]) + 1 if devices else 0)
+        for dev in devices:
+            self.devices[dev.slot] = dev
+        self.capacity = capacity
+        self.overflow = overflow
+
+        self.slot = array('i')
+        self.value = array('d')
+        self.epoch = array('d')
+        self.automated = array('b')
+        self.name = array('i')
+
+        # {dev: name}, devices without a name are recorded with ''
+        self.dev_names = dev_names if dev_names is not None else dict()
+        # recorded names by name id (id 0 is '')
+        self.names = list(journal.names) if journal is not None else ['']
+        self.name_ids = {name: i for i, name in enumerate(self.names)}
+
+        self.journal = journal
+        # sequence number of the first entry recorded by this store
+        # (journals continue the numbering of a previous run)
+        self.base_seq = journal.next_seq if journal is not None else 0
+        self.first_seq = self.base_seq
+        self.next_seq = self.base_seq
+        # number of entries lost to the overflow policy
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.next_seq - self.oldest_seq
+
+    @property
+    def oldest_seq(self):
+        # the oldest entry that can still be read
+        if self.journal is not None:
+            return self.journal.first_seq
+        return self.first_seq
+
+    def _name_id(self, name):
+        # called with the lock held
+        name_id = self.name_ids.get(name)
+        if name_id is None:
+            name_id = len(self.names)
+            self.names.append(name)
+            self.name_ids[name] = name_id
+            if self.journal is not None:
+                self.journal.add_name(name)
+        return name_id
+
+    def record(self, dev: Device, val, timestamp: datetime.datetime, is_automated=False):
+        epoch = (timestamp - _EPOCH).total_seconds() if timestamp is not None else math.nan
+        name = self.dev_names.get(dev, '')
+        with self.lock:
+            name_id = self._name_id(name)
+            if self.overflow == 'grow' or len(self.slot) < self.capacity:
+                self.slot.append(dev.slot)
+                self.value.append(val)
+                self.epoch.append(epoch)
+                self.automated.append(is_automated)
+                self.name.append(name_id)
+            elif self.overflow == 'drop':
+                self.dropped += 1
+                return
+            else:
+                i = (self.next_seq - self.base_seq) % self.capacity
+                self.slot[i] = dev.slot
+                self.value[i] = val
+                self.epoch[i] = epoch
+                self.automated[i] = is_automated
+                self.name[i] = name_id
+                self.first_seq += 1
+                if self.journal is None:
+                    self.dropped += 1
+            self.next_seq += 1
+            if self.journal is not None:
+                self.journal.append(dev, val, epoch, is_automated, name_id)
+
+    def flush(self):
+        # make the recorded entries durable (called once per tick)
+        if self.journal is not None:
+            with self.lock:
+                self.journal.flush()
+
+    @property
+    def acked_seq(self):
+        # the first entry not uploaded yet, as recorded by the journal of a previous run
+        if self.journal is not None:
+            return max(self.journal.acked_seq, self.oldest_seq)
+        return self.oldest_seq
+
+    def compact(self, seq):
+        # entries before seq have been uploaded and are no longer needed
+        if self.journal is not None:
+            with self.lock:
+                self.journal.ack(seq)
+                self.journal.compact(seq)
+
+    def close(self):
+        if self.journal is not None:
+            with self.lock:
+                self.journal.close()
+
+    def _ranges(self, start, stop):
+        # array index ranges holding the entries [start, stop)
+        if self.overflow != 'overwrite':
+            return [(start - self.base_seq, stop - self.base_seq)]
+        begin = (start - self.base_seq) % self.capacity
+        end = begin + stop - start
+        if end <= self.capacity:
+            return [(begin, end)]
+        return [(begin, self.capacity), (0, end - self.capacity)]
+
+    def columns(self, start, stop):
+        # copy the columns of the entries [start, stop)
+        # returns (start, devices, values, epochs, automated, name ids) where start may have moved
+        # forward if older entries have been overwritten in the meantime
+        with self.lock:
+            if self.journal is not None:
+                start = max(start, self.journal.first_seq)
+                if start < self.first_seq:
+                    # older than the hot tail
+                    stop = max(min(stop, self.next_seq), start)
+                    return (start,) + self.journal.read(start, stop)
+            start = max(start, self.first_seq)
+            stop = max(min(stop, self.next_seq), start)
+            stored = (self.slot, self.value, self.epoch, self.automated, self.name)
+            columns = [array(column.typecode) for column in stored]
+            for begin, end in self._ranges(start, stop):
+                for column, store in zip(columns, stored):
+                    column += store[begin:end]
+        devices = self.devices
+        columns[0] = [devices[slot] for slot in columns[0]]
+        return (start,) + tuple(columns)
+
+    def to_entries(self, devs, values, epochs, automated, name_ids):
+        # dict form of copied columns (see generate_trace_entry)
+        entries = []
+        names = self.names
+        for dev, val, epoch, is_automated, name_id in zip(devs, values, epochs, automated, name_ids):
+            if dev.datatype == 'Bit':
+                val = val != 0.0
+            timestamp = _EPOCH + datetime.timedelta(seconds=epoch) if not math.isnan(epoch) else None
+            name = names[name_id] if name_id < len(names) else ''
+            entries.append(generate_trace_entry(dev, val, timestamp, is_automated != 0, name))
+        return entries
+
+    def entries(self, start=None, stop=None):
+        # dict form of the entries with sequence numbers in [start, stop)
+        start = self.oldest_seq if start is None else start
+        stop = self.next_seq if stop is None else stop
+        return self.to_entries(*self.columns(start, stop)[1:])
+
+    def iter_batches(self, start, stop, batchsize):
+        # yield (first seq, next seq, entries) for batches of the entries [start, stop),
+        # building the dict form of one batch at a time
+        while start < stop:
+            start, *columns = self.columns(start, min(start + batchsize, stop))
+            if start >= stop:
+                return
+            batch_stop = start + len(columns[0])
+            yield start, batch_stop, self.to_entries(*columns)
+            start = batch_stop
@@ -0,0 +1,77 @@
+from device import Device, output_bits
+
+
+###################################################
+# per-tick buffer of memory map writes
+# actions, default controllers and motor resets write
+# into the buffer; the last write to a device wins and
+# the monitor flushes everything with one
+# memory_map.Instance.Update() at the end of the tick.
+# The monitor also applies the writes made while the
+# inputs were handled (apply) before it reads the outputs,
+# so those writes are seen by the same tick.
+# Writing True to a motor also writes False to its
+# opposite motor (interlock), so both motors of a pair
+# are never driven at once.
+# This should be used when memory map is locked
+###################################################
+class WriteBuffer(object):
+    def __init__(self, interlocks=None):
+        """
+
+        :param interlocks: {motor address: opposite motor address} of output bits
+        """
+        self.interlocks = {output_bits[motor]: output_bits[opposite]
+                           for motor, opposite in (interlocks or {}).items()}
+        # {dev: val} in the order of the last writes
+        self.pending = dict()
+        # memory objects of the devices written so far
+        self.handles = dict()
+        # writes applied since the last Update()
+        self.unflushed = 0
+
+        # statistics
+        self.writes = 0
+        self.coalesced = 0
+        self.flushes = 0
+
+    def write(self, dev: Device, val):
+        self.writes += 1
+        if dev in self.pending:
+            # an earlier write of this tick is overridden
+            self.coalesced += 1
+            del self.pending[dev]
+        if val:
+            opposite = self.interlocks.get(dev)
+            if opposite is not None:
+                self.pending.pop(opposite, None)
+                self.pending[opposite] = False
+        self.pending[dev] = val
+
+    def apply(self, meta_info):
+        # set the memory objects of the pending writes without Update(),
+        # returns the [(dev, val)] applied
+        if not self.pending:
+            return []
+        handles = self.handles
+        for dev, val in self.pending.items():
+            handle = handles.get(dev)
+            if handle is None:
+                handle = meta_info.get_funcs[dev.datatype](dev.address, meta_info.mem_types[dev.typ])
+                handles[dev] = handle
+            handle.Value = val
+        applied = list(self.pending.items())
+        self.pending = dict()
+        self.unflushed += len(applied)
+        return applied
+
+    def flush(self, meta_info):
+        # apply the pending writes and Update() once, returns the number of writes applied in this tick
+        self.apply(meta_info)
+        if not self.unflushed:
+            return 0
+        meta_info.memory_map.Instance.Update()
+        num_writes = self.unflushed
+        self.unflushed = 0
+        self.flushes += 1
+        return num_writes